@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Minimal machine/neopixel stand-ins for running the benchmarks on the
+MicroPython unix port. Writes go nowhere, so only the firmware's own work
+is measured. NoPersistence is shared with sim/replay.py.
+"""
+
+import sys
+
+
+class Pin(object):
+    IN = 1
+    OUT = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self._value = 1
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if value is not None:
+            self._value = value
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = value
+
+    __call__ = value
+
+    def irq(self, handler=None, trigger=3):
+        pass
+
+
+class SPI(object):
+    def __init__(self, id=0, baudrate=1000000, **kwargs):
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+
+    def deinit(self):
+        pass
+
+
+class NeoPixel(object):
+    def __init__(self, pin, n, bpp=3, timing=1):
+        self.n = n
+        self.buf = bytearray(n * bpp)
+        self._pixels = [(0, 0, 0)] * n
+
+    def __setitem__(self, index, value):
+        self._pixels[index] = value
+
+    def __getitem__(self, index):
+        return self._pixels[index]
+
+    def write(self):
+        pass
+
+
+class NoPersistence(object):
+    # persistence.Persistence that never saves
+    def mark_dirty(self, key, saver):
+        pass
+
+    def request_flush(self):
+        pass
+
+
+class machine(object):
+    Pin = Pin
+    SPI = SPI
+
+
+class neopixel(object):
+    NeoPixel = NeoPixel
+
+
+def install():
+    sys.modules["machine"] = machine
+    sys.modules["neopixel"] = neopixel
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Check the kernels in src/kernels.py against straightforward reference
+implementations.
+
+From the repository root:
+
+    python3 bench/parity.py       # the Python kernels
+    micropython bench/parity.py   # the viper kernels, where the port has them
+
+Prints which kernels ran and every mismatch, the exit status is 1 if there
+was one. Run it on the board's MicroPython build as well before relying on
+the viper kernels there, the emitter differs per architecture.
+"""
+
+import sys
+
+MICROPYTHON = sys.implementation.name == "micropython"
+
+
+def find(name):
+    for prefix in ("src/", "/"):
+        try:
+            open(prefix + name).close()
+            return prefix + name
+        except OSError:
+            pass
+    raise OSError("{} not found".format(name))
+
+
+def numbers(seed, count, limit):
+    # deterministic, random isn't there on every port
+    values = []
+    for _ in range(count):
+        seed = (seed * 1103515245 + 12345) & 0x7FFFFFFF
+        values.append(seed % limit)
+    return values
+
+
+def reference_glyph(font, code, color, background):
+    # pixel (column, row) is bit row % 8 of the column's row // 8-th byte
+    offset = (code - font.start_letter) * font.bytes_per_letter
+    width = font.letters[offset]
+    height_bytes = (font.bytes_per_letter - 1) // font.width
+    buf = bytearray()
+    for column in range(width):
+        for row in range(font.height):
+            b = font.letters[offset + 1 + column * height_bytes + row // 8]
+            pixel = color if b >> (row % 8) & 1 else background
+            buf += pixel.to_bytes(2, "big")
+    return buf, width
+
+
+def check_glyph(kernels, fonts):
+    import array
+    errors = 0
+    for font in fonts:
+        size = font.width * font.height * 2
+        buf = bytearray(size)
+        params = array.array("H", (font.height, (font.bytes_per_letter - 1) // font.width, 0, 0))
+        for color, background in ((0x07E0, 0x0000), (0xFFFF, 0x1082), (0x0000, 0xF800)):
+            params[kernels.GLYPH_COLOR] = color
+            params[kernels.GLYPH_BACKGROUND] = background
+            for code in range(font.start_letter, font.start_letter + font.letter_count):
+                # garbage from the previous letter has to be overwritten
+                for i in range(size):
+                    buf[i] = 0xA5
+                expected, width = reference_glyph(font, code, color, background)
+                w = kernels.glyph(buf, font.letters, (code - font.start_letter) * font.bytes_per_letter, params)
+                if w != width or buf[:len(expected)] != expected:
+                    print("PARITY: glyph {!r} {}x{} color={:04x} background={:04x} differs".format(
+                        chr(code), font.width, font.height, color, background))
+                    errors += 1
+    return errors
+
+
+def check_fill(kernels):
+    errors = 0
+    for color in (0x0000, 0x07E0, 0xF81F, 0xFFFF, 0x1234):
+        for count in (0, 1, 7, 128, 1024):
+            buf = bytearray(2048)
+            kernels.fill(buf, color, count)
+            expected = color.to_bytes(2, "big") * count + bytes(2048 - count * 2)
+            if buf != expected:
+                print("PARITY: fill color={:04x} count={} differs".format(color, count))
+                errors += 1
+    return errors
+
+
+def check_scale(kernels):
+    # what BreathingEffect computed before
+    errors = 0
+    out = bytearray(3)
+    for level in range(256):
+        for c in range(256):
+            color = bytearray((c, 255 - c, c // 2))
+            kernels.scale(out, color, level)
+            expected = bytearray(int((level / 256) * x) for x in color)
+            if out != expected:
+                print("PARITY: scale color={} level={} differs".format(tuple(color), level))
+                errors += 1
+    return errors
+
+
+def check_diffuse(kernels):
+    # what FireEffect computed before, heat up to HEAT_MAX
+    import array
+    errors = 0
+    for seed, count in ((1, 17), (2, 60), (3, 3), (4, 2)):
+        for limit in (256, 1024, kernels.HEAT_MAX + 1):
+            values = numbers(seed, count, limit)
+            values[:min(count, 3)] = [kernels.HEAT_MAX] * min(count, 3)
+            heat = array.array("H", values)
+            kernels.diffuse(heat, count)
+            for i in range(count - 1, 1, -1):
+                values[i] = (values[i - 1] + values[i - 2] + values[i - 2]) // 3
+            if list(heat) != values:
+                print("PARITY: diffuse count={} limit={} differs".format(count, limit))
+                errors += 1
+    return errors
+
+
+def main():
+    sys.path[:0] = ["src", "src/lib"]
+    import kernels
+    from xglcd_font import XglcdFont
+
+    fonts = (XglcdFont(find("fonts/Unispace12x24.c"), 12, 24),
+             XglcdFont(find("fonts/FixedFont5x8.c"), 5, 7))
+    print("PARITY: {} kernels on {}".format("viper" if kernels.NATIVE else "Python", sys.implementation.name))
+    errors = 0
+    errors += check_glyph(kernels, fonts)
+    errors += check_fill(kernels)
+    errors += check_scale(kernels)
+    errors += check_diffuse(kernels)
+    print("PARITY: {} mismatches".format(errors))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Run the benchmark suite and compare against a stored baseline.
+
+From the repository root, on CPython (through the simulator) or on the
+MicroPython unix port:
+
+    python3 bench/run.py [--save] [--threshold PERCENT] [--only PREFIX]
+    micropython bench/run.py [...]
+
+Prints microseconds per operation for every benchmark and writes the
+results as JSON to stdout.
+
+Baselines are local and opt-in: none are committed, since timings only
+compare between runs on the same machine. --save stores the results in
+bench/baselines/<implementation>.json (ignored by git). Once one is there,
+every run compares against it and the exit status is 1 if anything got
+slower than the threshold (default 10%). Without one nothing is compared.
+Save one before starting on a change.
+"""
+
+import sys
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+MICROPYTHON = sys.implementation.name == "micropython"
+THRESHOLD = 10.0 # percent
+
+
+def load_suite():
+    if MICROPYTHON:
+        sys.path[:0] = ["bench", "src", "src/lib"]
+        import fakes
+        fakes.install()
+        import suite
+        return suite, "bench/baselines/micropython.json", None
+
+    import os
+    bench = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.dirname(bench))
+    from sim import Simulator
+
+    # time follows host CPU time so the suite can time itself with utime
+    sim = Simulator(cpu_scale=1.0, paths=[bench])
+    return sim.load("suite"), os.path.join(bench, "baselines", "cpython.json"), sim
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_baseline(path, results):
+    directory = path.rsplit("/", 1)[0]
+    try:
+        import os
+        os.mkdir(directory)
+    except OSError:
+        pass
+    with open(path, "w") as f:
+        json.dump(results, f)
+
+
+def compare(results, baseline, threshold):
+    # (name, baseline us, us, change in percent), slower first
+    changes = []
+    for name, value in results.items():
+        old = baseline.get(name)
+        if old:
+            changes.append((name, old, value, (value - old) * 100.0 / old))
+    changes.sort(key=lambda change: -change[3])
+    return changes
+
+
+def log(line):
+    sys.stderr.write(line + "\n")
+
+
+def main(args):
+    save = "--save" in args
+    threshold = THRESHOLD
+    only = None
+    for i in range(len(args) - 1):
+        if args[i] == "--threshold":
+            threshold = float(args[i + 1])
+        elif args[i] == "--only":
+            only = args[i + 1]
+
+    suite, path, sim = load_suite()
+    try:
+        results = suite.run(only, lambda name, value: log("{:32s} {:12.1f} us".format(name, value)))
+    finally:
+        if sim is not None:
+            sim.close()
+
+    output = {"implementation": sys.implementation.name, "results": results}
+    baseline = load_baseline(path)
+    regressions = []
+    if baseline:
+        log("")
+        log("{:32s} {:>12s} {:>12s} {:>8s}".format("vs. " + path, "baseline", "now", "change"))
+        for name, old, value, change in compare(results, baseline, threshold):
+            flag = ""
+            if change > threshold:
+                flag = " SLOWER"
+                regressions.append(name)
+            elif change < -threshold:
+                flag = " faster"
+            log("{:32s} {:12.1f} {:12.1f} {:+7.1f}%{}".format(name, old, value, change, flag))
+        output["baseline"] = baseline
+        output["regressions"] = regressions
+
+    if save:
+        save_baseline(path, results)
+        log("Saved baseline to {}".format(path))
+
+    print(json.dumps(output))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
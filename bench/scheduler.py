@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Task switch throughput of the bundled uasyncio event loop.
+
+On the MicroPython unix port, or on CPython through the simulator as part
+of the benchmark suite (the simulator provides utimeq and friends):
+
+    micropython bench/scheduler.py [duration_ms]
+    python3 bench/run.py --only scheduler
+
+Runs a few tasks that yield back to the loop in the ways the firmware does
+(sleep_ms(0), plain yield, short sleeps) and prints task switches per
+second for each. On CPython the host's load makes runs vary by 10-20%,
+compare several.
+"""
+
+import sys
+sys.path.insert(0, "src/lib")
+
+import utime as time
+import uasyncio as asyncio
+
+TASKS = 4
+
+
+def count_sleep0(counter):
+    while True:
+        counter[0] += 1
+        yield from asyncio.sleep_ms(0)
+
+
+def count_yield(counter):
+    while True:
+        counter[0] += 1
+        yield
+
+
+def count_sleep1(counter):
+    while True:
+        counter[0] += 1
+        yield from asyncio.sleep_ms(1)
+
+
+def run(name, task, duration_ms):
+    loop = asyncio.get_event_loop()
+    counter = [0]
+    for _ in range(TASKS):
+        loop.create_task(task(counter))
+
+    def stop():
+        yield from asyncio.sleep_ms(duration_ms)
+        yield asyncio.StopLoop(0)
+
+    start = time.ticks_us()
+    loop.run_until_complete(stop())
+    elapsed = time.ticks_diff(time.ticks_us(), start)
+
+    # forget the benchmark tasks before the next run
+    asyncio.core._event_loop = None
+    rate = counter[0] * 1000000 // elapsed
+    print("{}: {} switches/s".format(name, rate))
+    return rate
+
+
+def main(duration_ms=2000):
+    return {
+        "sleep_ms(0)": run("sleep_ms(0)", count_sleep0, duration_ms),
+        "yield": run("yield", count_yield, duration_ms),
+        "sleep_ms(1)": run("sleep_ms(1)", count_sleep1, duration_ms),
+    }
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
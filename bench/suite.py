@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of the firmware's hot paths.
+
+Imported by bench/run.py, either on the MicroPython unix port with the
+stand-ins from bench/fakes.py or on CPython through the simulator. Every
+benchmark reports microseconds per operation, lower is better.
+"""
+
+import utime as time
+
+import uasyncio as asyncio
+
+from fakes import NoPersistence, Pin, SPI
+
+TARGET_MS = 200 # per benchmark and repeat
+REPEATS = 5
+
+
+def find(name):
+    # the flash root on the board and the simulator, src/ on the unix port
+    for prefix in ("/", "src/"):
+        try:
+            open(prefix + name).close()
+            return prefix + name
+        except OSError:
+            pass
+    raise OSError("{} not found".format(name))
+
+
+def measure(func, target_ms=TARGET_MS, repeats=REPEATS):
+    # calibrate the iteration count on a single call, then report the best
+    # of a few repeats
+    start = time.ticks_us()
+    func()
+    once = max(1, time.ticks_diff(time.ticks_us(), start))
+    iterations = max(1, target_ms * 1000 // once)
+
+    best = None
+    for _ in range(repeats):
+        start = time.ticks_us()
+        for _ in range(iterations):
+            func()
+        elapsed = time.ticks_diff(time.ticks_us(), start) / iterations
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def _fonts():
+    from xglcd_font import XglcdFont
+    return (XglcdFont(find("fonts/Unispace12x24.c"), 12, 24),
+            XglcdFont(find("fonts/FixedFont5x8.c"), 5, 7))
+
+
+def _display():
+    # what the firmware draws through, see display.open_display()
+    from display import SafeDisplay
+    return SafeDisplay(SPI(), cs=Pin(0), dc=Pin(1), rst=Pin(2))
+
+
+def render():
+    import display
+    from ssd1351 import color565
+    unispace, fixed = _fonts()
+    oled = _display()
+    green = color565(0, 255, 0)
+    logo = find("36c3-logo.raw")
+    # the speed screen formats its values into a reused buffer
+    text = bytearray(16)
+    length = display.format_number(text, 2345)
+
+    return (
+        ("font.get_letter", lambda: unispace.get_letter("8", green)),
+        ("display.format_number", lambda: display.format_number(text, 2345)),
+        ("display.draw_text.unispace", lambda: oled.draw_text(0, 9, text, unispace, green, length=length)),
+        ("display.draw_text.fixed", lambda: oled.draw_text(0, 54, "Top Speed (km/h)", fixed, green)),
+        ("display.fill_hrect", lambda: oled.fill_hrect(0, 9, 127, 25, 0)),
+        ("display.clear", lambda: oled.clear()),
+        ("display.draw_image", lambda: oled.draw_image(logo, w=127, h=127)),
+    )
+
+
+def effects():
+    import lights
+    light_show = lights.LightShow(persistence=NoPersistence())
+    strip = light_show._lights
+
+    def frame(effect):
+        # one step of the effect up to its next sleep is one frame
+        state = [effect.run(strip)]
+
+        def step():
+            try:
+                next(state[0])
+            except StopIteration:
+                state[0] = effect.run(strip)
+        return step
+
+    return tuple(("effect." + name, frame(effect))
+                 for name, effect in sorted(light_show._effects.items()))
+
+
+def speedometer():
+    import speedometer
+    sm = speedometer.Speedometer(persistence=NoPersistence())
+    counter = sm.counter
+    mask = counter.PULSE_BUFFER - 1
+    update = sm.update()
+    pulse = [0]
+
+    def step():
+        # a second of riding at 35 km/h, the way the reed IRQ queues it
+        for _ in range(16):
+            pulse[0] += 65
+            counter._pulses[counter._pulse_head & mask] = pulse[0]
+            counter._pulse_head += 1
+            counter._counter += 1
+        next(update)
+
+    return (("speedometer.update", step),)
+
+
+def scheduler(duration_ms=1000):
+    import scheduler
+    # the benchmark tasks should have the loop to themselves
+    asyncio.core._event_loop = None
+    rates = scheduler.main(duration_ms)
+    return dict(("scheduler." + name, 1000000.0 / rate) for name, rate in rates.items() if rate)
+
+
+def kernels():
+    import array
+    import kernels
+    from ssd1351 import color565
+    unispace, fixed = _fonts()
+    green = color565(0, 255, 0)
+    glyph = bytearray(unispace.width * unispace.height * 2)
+    params = array.array("H", (unispace.height, (unispace.bytes_per_letter - 1) // unispace.width, green, 0))
+    offset = (ord("8") - unispace.start_letter) * unispace.bytes_per_letter
+    fill = bytearray(2048)
+    scaled = bytearray(3)
+    color = bytearray((255, 128, 0))
+    heat = array.array("H", range(0, 1200, 20))
+
+    return (
+        ("kernels.glyph", lambda: kernels.glyph(glyph, unispace.letters, offset, params)),
+        ("kernels.fill", lambda: kernels.fill(fill, green, 1024)),
+        ("kernels.scale", lambda: kernels.scale(scaled, color, 128)),
+        ("kernels.diffuse", lambda: kernels.diffuse(heat, len(heat))),
+    )
+
+
+GROUPS = (render, effects, speedometer, kernels)
+
+
+def _selected(name, only):
+    return not only or name.startswith(only) or only.startswith(name)
+
+
+def run(only=None, progress=None):
+    # name -> us per operation, only runs benchmarks starting with only
+    results = {}
+    for group in GROUPS:
+        for name, func in group():
+            if _selected(name, only):
+                results[name] = measure(func)
+                if progress:
+                    progress(name, results[name])
+
+    if _selected("scheduler", only):
+        for name, value in sorted(scheduler().items()):
+            if _selected(name, only):
+                results[name] = value
+                if progress:
+                    progress(name, value)
+
+    # don't leave the firmware's tasks behind on the loop
+    asyncio.core._event_loop = None
+    return results
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Generate the frozen font and image modules for freeze/manifest.py.
+
+    python3 freeze/build.py
+
+Writes every font and image the firmware uses as a Python module holding a
+bytes object to freeze/build/. Frozen into the firmware, that data is read
+straight from flash, instead of the fonts being parsed into RAM at boot and
+the logo being read from the filesystem. The firmware falls back to the
+files in src/ when the modules are missing.
+
+Also checks that the manifest covers every module in src/ but main.py and,
+with mpy-cross installed, prints the bytecode size per module: heap the
+modules take at runtime when imported as .mpy from the filesystem, which
+the frozen build gets back. Compare with the "BOOT: done" line the firmware
+prints, with and without the frozen build.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+FREEZE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(os.path.dirname(FREEZE), "src")
+BUILD = os.path.join(FREEZE, "build")
+
+# module name, path in src/, width, height, as the firmware loads them
+FONTS = (
+    ("font_unispace12x24", "fonts/Unispace12x24.c", 12, 24),
+    ("font_fixed5x8", "fonts/FixedFont5x8.c", 5, 7),
+)
+IMAGES = (
+    ("image_36c3_logo", "36c3-logo.raw", 127, 127),
+)
+
+
+def write_module(name, source, **values):
+    path = os.path.join(BUILD, name + ".py")
+    with open(path, "w") as f:
+        f.write("# generated by freeze/build.py from {}, do not edit\n".format(source))
+        for key, value in sorted(values.items()):
+            f.write("{} = {!r}\n".format(key, value))
+    return path
+
+
+def build_assets():
+    sys.path.insert(0, os.path.join(SRC, "lib"))
+    from xglcd_font import XglcdFont
+
+    if os.path.isdir(BUILD):
+        shutil.rmtree(BUILD)
+    os.makedirs(BUILD)
+
+    sizes = []
+    for name, source, width, height in FONTS:
+        font = XglcdFont(os.path.join(SRC, source), width, height)
+        write_module(name, source, WIDTH=width, HEIGHT=height, LETTERS=bytes(font.letters))
+        sizes.append((name, len(font.letters)))
+
+    for name, source, width, height in IMAGES:
+        with open(os.path.join(SRC, source), "rb") as f:
+            pixels = f.read()
+        if len(pixels) != width * height * 2:
+            raise ValueError("{} is not {}x{} RGB565".format(source, width, height))
+        write_module(name, source, WIDTH=width, HEIGHT=height, PIXELS=pixels)
+        sizes.append((name, len(pixels)))
+    return sizes
+
+
+def manifest_modules():
+    # (directory, module path) of everything the manifest freezes
+    modules = []
+
+    def freeze(path, script=None, opt=0):
+        if isinstance(script, str):
+            script = (script,)
+        for name in script or ():
+            modules.append((os.path.normpath(os.path.join(FREEZE, path)), name))
+
+    with open(os.path.join(FREEZE, "manifest.py")) as f:
+        exec(f.read(), dict(freeze=freeze, include=lambda path: None))
+    return modules
+
+
+def check_manifest(modules):
+    frozen = set(os.path.join(path, name) for path, name in modules)
+    missing = []
+    for directory, _, files in os.walk(SRC):
+        for name in files:
+            path = os.path.join(directory, name)
+            if name.endswith(".py") and path != os.path.join(SRC, "main.py") and path not in frozen:
+                missing.append(os.path.relpath(path, SRC))
+    return sorted(missing)
+
+
+def bytecode_sizes(modules):
+    mpy_cross = shutil.which("mpy-cross")
+    if mpy_cross is None:
+        return None
+    sizes = []
+    tmp = tempfile.mkdtemp()
+    try:
+        for path, name in modules:
+            out = os.path.join(tmp, name.replace("/", "_") + ".mpy")
+            # the ESP32 architecture, for the viper kernels
+            subprocess.check_call([mpy_cross, "-march=xtensawin", "-o", out, name], cwd=path)
+            sizes.append((name, os.path.getsize(out)))
+    finally:
+        shutil.rmtree(tmp)
+    return sizes
+
+
+def main():
+    assets = build_assets()
+    print("Assets in {}:".format(os.path.relpath(BUILD)))
+    for name, size in assets:
+        print("  {:32s} {:8d} bytes".format(name, size))
+
+    modules = manifest_modules()
+    missing = check_manifest(modules)
+    if missing:
+        print("Not in freeze/manifest.py, loaded from the filesystem: {}".format(", ".join(missing)))
+
+    sizes = bytecode_sizes([module for module in modules if module[0] != BUILD])
+    if sizes is None:
+        print("mpy-cross not found, skipping bytecode sizes")
+    else:
+        print("Bytecode, kept in RAM when imported from the filesystem:")
+        for name, size in sizes:
+            print("  {:32s} {:8d} bytes".format(name, size))
+        print("  {:32s} {:8d} bytes".format("total", sum(size for _, size in sizes)))
+    return 1 if missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+# Frozen modules for the firmware, for MicroPython 1.12 on the ESP32. Run
+# freeze/build.py first, it generates the font and image modules, then
+# build MicroPython with
+#
+#   make -C ports/esp32 FROZEN_MANIFEST=/path/to/c3scooter/freeze/manifest.py
+#
+# main.py stays on the filesystem. Paths are relative to this file.
+
+include("$(PORT_DIR)/boards/manifest.py")
+
+freeze("../src", (
+    "button.py",
+    "display.py",
+    "events.py",
+    "kernels.py",
+    "kernels_viper.py",
+    "latency.py",
+    "lights.py",
+    "memstat.py",
+    "persistence.py",
+    "pulselog.py",
+    "ridelog.py",
+    "speedometer.py",
+    "tripstats.py",
+))
+
+freeze("../src/lib", (
+    "aswitch.py",
+    "rotary.py",
+    "rotary_irq_esp.py",
+    "ssd1351.py",
+    "xglcd_font.py",
+    "uasyncio/__init__.py",
+    "uasyncio/collector.py",
+    "uasyncio/core.py",
+    "uasyncio/profiler.py",
+    "uasyncio/queues.py",
+    "uasyncio/synchro.py",
+    "uasyncio/watchdog.py",
+))
+
+# fonts and images as bytes objects, generated by build.py
+freeze("build")
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""Host simulator for the scooter firmware.
+
+Runs the unmodified firmware from src/ on CPython with stand-ins for
+machine, neopixel, micropython, utime and friends, on a virtual clock. See
+``python3 -m sim --help``.
+"""
+
+from sim.clock import SimulationEnd, VirtualClock
+from sim.simulator import Simulator
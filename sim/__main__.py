@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Fast-forward a ride through the firmware and print what it cost.
+
+    python3 -m sim --minutes 60 --speed 25 --frames /tmp/frames
+
+Rides at the given speed, flips through the screens with the encoder and
+clicks the button now and then, then prints the report as JSON.
+"""
+
+import argparse
+import json
+import sys
+
+from sim import Simulator
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python3 -m sim", description=__doc__.splitlines()[0])
+    parser.add_argument("--minutes", type=float, default=10, help="virtual time to simulate")
+    parser.add_argument("--speed", type=float, default=25, help="cruising speed in km/h")
+    parser.add_argument("--bounce", type=int, default=0, help="reed switch bounces per revolution")
+    parser.add_argument("--flash", help="directory to keep the simulated flash in")
+    parser.add_argument("--frames", help="directory to save the last display frames to")
+    parser.add_argument("--record", type=int, default=16, help="display frames to keep for --frames")
+    parser.add_argument("--memory", action="store_true", help="trace host memory, slows things down")
+    parser.add_argument("--cpu-scale", type=float, default=0.0,
+                        help="add host CPU time times this to virtual time, 0 for deterministic runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show the firmware's output")
+    args = parser.parse_args(args)
+
+    duration = int(args.minutes * 60 * 1000)
+    with Simulator(flash=args.flash, seed=args.seed, verbose=args.verbose,
+                   record_frames=args.record if args.frames else 0,
+                   trace_memory=args.memory, cpu_scale=args.cpu_scale) as sim:
+        # leave the board standing for a bit at both ends so the ride ends
+        ride_start = min(5000, duration // 10)
+        ride_end = max(ride_start, duration - 3 * 60 * 1000)
+        sim.ride(args.speed, ride_start, ride_end - ride_start, bounce=args.bounce)
+
+        # visit every screen once a minute and click on it
+        t = 2000
+        while t < duration:
+            sim.turn(1, t)
+            sim.click(t + 1000)
+            t += 60 * 1000
+
+        report = sim.run(duration)
+        if args.frames:
+            report["saved_frames"] = sim.save_frames(args.frames)
+
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""Checks of the bundled uasyncio event loop on the simulated board.
+
+    python3 -m sim.checks
+
+Runs small task setups that went wrong before and prints one line per
+check, the exit status is 1 if one failed.
+"""
+
+import struct
+import sys
+
+from sim import Simulator
+
+SWITCHES = 20000
+
+
+def _loop(sim):
+    # a fresh event loop for every check
+    core = sim.load("uasyncio.core")
+    core._event_loop = None
+    return core.get_event_loop()
+
+
+def high_priority_sleep0():
+    # A high priority task rescheduling itself with sleep_ms(0) must not
+    # starve normal tasks nor keep due sleepers in waitq
+    with Simulator(cpu_scale=1.0) as sim:
+        asyncio = sim.load("uasyncio")
+        loop = _loop(sim)
+        counts = dict(high=0, normal=0, sleeper=0)
+
+        def high():
+            while counts["high"] < SWITCHES:
+                counts["high"] += 1
+                yield from asyncio.sleep_ms(0)
+            yield asyncio.StopLoop(0)
+
+        def normal():
+            while True:
+                counts["normal"] += 1
+                yield from asyncio.sleep_ms(0)
+
+        def sleeper():
+            while True:
+                counts["sleeper"] += 1
+                yield from asyncio.sleep_ms(10)
+
+        loop.create_task(high(), asyncio.PRIORITY_HIGH)
+        loop.create_task(normal())
+        loop.create_task(sleeper())
+        loop.run_forever()
+        ok = counts["normal"] >= SWITCHES // 2 and counts["sleeper"] > 1
+        return ok, "{high} high, {normal} normal, {sleeper} sleeper slices".format(**counts)
+
+
+def flag_isr_queue_full():
+    # Flag.isr() with the schedule queue full may only set the flag, a
+    # waiter parked without a timeout has to be resumed by the loop anyway
+    with Simulator() as sim:
+        asyncio = sim.load("uasyncio")
+        synchro = sim.load("uasyncio.synchro")
+        loop = _loop(sim)
+        flag = synchro.Flag()
+        woken = []
+
+        def full(func, arg):
+            raise RuntimeError("schedule queue full")
+
+        def waiter():
+            woken.append((yield from flag.wait()))
+
+        def stop():
+            yield from asyncio.sleep_ms(100)
+            yield asyncio.StopLoop(0)
+
+        schedule = synchro.micropython.schedule
+        synchro.micropython.schedule = full
+        try:
+            sim.at(10, flag.isr)
+            loop.create_task(waiter())
+            loop.run_until_complete(stop())
+        finally:
+            synchro.micropython.schedule = schedule
+        return woken == [True], "waiter woken: {}".format(woken)
+
+
+def idle_wait_unsliced():
+    # With no Flag waiter parked the loop sleeps until the next task is
+    # due in one go, it only wakes every WAKE_SLICE_MS while there is one
+    with Simulator() as sim:
+        asyncio = sim.load("uasyncio")
+        core = sim.load("uasyncio.core")
+        synchro = sim.load("uasyncio.synchro")
+        loop = _loop(sim)
+        flag = synchro.Flag()
+        sleeps = []
+        ipoll = loop.poller.ipoll
+
+        def count(timeout, flags):
+            sleeps.append(timeout)
+            return ipoll(timeout, flags)
+
+        def waiter():
+            yield from flag.wait(100)
+
+        def stop():
+            yield from asyncio.sleep_ms(1000)
+            idle = len(sleeps)
+            loop.create_task(waiter())
+            yield from asyncio.sleep_ms(1000)
+            sleeps.append(idle)
+            yield asyncio.StopLoop(0)
+
+        loop.poller.ipoll = count
+        loop.run_until_complete(stop())
+        idle = sleeps.pop()
+        slices = len([ms for ms in sleeps[idle:] if 0 < ms <= core.WAKE_SLICE_MS])
+        ok = idle == 1 and slices == 100 // core.WAKE_SLICE_MS
+        return ok, "{} sleeps idle, {} slices with a waiter parked for 100 ms".format(idle, slices)
+
+
+def queue_order_backpressure():
+    # Items come out in the order they went in, and a producer faster
+    # than its consumer parks in put() once maxsize items are queued
+    with Simulator() as sim:
+        asyncio = sim.load("uasyncio")
+        queues = sim.load("uasyncio.queues")
+        loop = _loop(sim)
+        results = []
+        for cls in (queues.Queue, queues.RingQueue):
+            q = cls(3)
+            got = []
+            sizes = []
+
+            def producer():
+                for i in range(20):
+                    yield from q.put(i)
+                    sizes.append(q.qsize())
+
+            def consumer():
+                while len(got) < 20:
+                    got.append((yield from q.get()))
+                    yield from asyncio.sleep_ms(10)
+
+            def stop():
+                yield from asyncio.sleep_ms(500)
+                yield asyncio.StopLoop(0)
+
+            loop.create_task(producer())
+            loop.create_task(consumer())
+            loop.run_until_complete(stop())
+            results.append(got == list(range(20)) and max(sizes) == 3
+                           and not q._getters and not q._putters)
+        return all(results), "Queue {}, RingQueue {}".format(*("ok" if ok else "wrong" for ok in results))
+
+
+def queue_cancelled_getter():
+    # A getter cancelled while parked leaves the waiting list, and one
+    # cancelled after a put() woke it hands the item on to the next getter
+    # (thrown in directly, CPython generators have no pend_throw())
+    with Simulator() as sim:
+        asyncio = sim.load("uasyncio")
+        queues = sim.load("uasyncio.queues")
+        loop = _loop(sim)
+        q = queues.Queue()
+        got = []
+
+        def getter(name):
+            got.append((name, (yield from q.get())))
+
+        def cancel(task):
+            try:
+                task.throw(asyncio.CancelledError())
+            except asyncio.CancelledError:
+                pass
+
+        tasks = [getter(name) for name in "abc"]
+
+        def stop():
+            for task in tasks:
+                loop.create_task(task)
+            yield from asyncio.sleep_ms(10)
+            cancel(tasks[0])
+            parked = len(q._getters)
+            q.put_nowait(1)
+            cancel(tasks[1])
+            yield from asyncio.sleep_ms(10)
+            got.append(parked)
+            yield asyncio.StopLoop(0)
+
+        loop.run_until_complete(stop())
+        ok = got == [("c", 1), 2] and not q._getters
+        return ok, "got {}, {} getters left".format(got, len(q._getters))
+
+
+def ride_start_at_file_boundary():
+    # The position a ride starts at has to be where its first sample ends
+    # up, also when the log rotates to the next file right before it
+    with Simulator() as sim:
+        ridelog = sim.load("ridelog")
+        _loop(sim)
+        # four samples per page, two pages per file
+        page_size = 4 * ridelog.SAMPLE_SIZE
+        logger = ridelog.RideLogger("/data/check", page_size=page_size, file_size=2 * page_size)
+        wrong = []
+
+        def ride(timestamp):
+            position = logger.start_ride()
+            logger.log(timestamp, 0, 0, 0)
+            logger.shutdown()
+            with sim.flash.open(ridelog.log_path("/data/check", "ride", position[0]), "rb") as f:
+                f.seek(position[1])
+                data = f.read(ridelog.SAMPLE_SIZE)
+            if len(data) < ridelog.SAMPLE_SIZE or struct.unpack(ridelog.SAMPLE, data)[0] != timestamp:
+                wrong.append(position)
+
+        for i in range(4):
+            logger.log(i, 0, 0, 0)
+        logger.shutdown()
+        # the first file ends with the next full page
+        for i in range(4):
+            logger.log(i, 0, 0, 0)
+        ride(1001)
+        # and once in the middle of a page
+        logger.log(0, 0, 0, 0)
+        ride(1002)
+        return not wrong, "rides at {} start elsewhere".format(wrong) if wrong else "both rides found"
+
+
+def late_second_press():
+    # A second press whose edge comes just before the double click time
+    # runs out, but is only debounced after it, is no double click
+    with Simulator() as sim:
+        asyncio = sim.load("uasyncio")
+        button = sim.load("button")
+        display = sim.load("display")
+        loop = _loop(sim)
+        pb = button.Pushbutton(display.Pin(display.PIN_KNOB_SWITCH, display.Pin.IN))
+        counts = dict(press=0, double=0)
+
+        def count(name):
+            counts[name] += 1
+
+        pb.press_func(count, ("press",))
+        pb.double_func(count, ("double",))
+        # the first press is debounced at 50 ms, the double click time
+        # ends at 450 ms and the second press is debounced at 470 ms
+        sim.press(0, 80)
+        sim.press(420, 80)
+        # a real one still counts
+        sim.double_click(2000)
+
+        def stop():
+            yield from asyncio.sleep_ms(3000)
+            yield asyncio.StopLoop(0)
+
+        loop.run_until_complete(stop())
+        return counts == dict(press=4, double=1), "{press} presses, {double} double clicks".format(**counts)
+
+
+def profiler_forgets_finished():
+    # TaskProfiler keeps entries for live tasks only: none for callbacks
+    # and none for tasks that finished (CPython generators can't be
+    # cancelled the MicroPython way, pend_throw() is missing)
+    with Simulator() as sim:
+        asyncio = sim.load("uasyncio")
+        profiler = sim.load("uasyncio.profiler")
+        loop = _loop(sim)
+        loop.monitor = None
+        prof = profiler.TaskProfiler().install(loop)
+        calls = []
+
+        def short():
+            yield from asyncio.sleep_ms(1)
+
+        def stop():
+            for _ in range(50):
+                loop.create_task(short())
+                loop.call_later_ms(1, calls.append, 1)
+                yield from asyncio.sleep_ms(5)
+            yield asyncio.StopLoop(0)
+
+        loop.run_until_complete(stop())
+        names = [entry[0] for entry in prof.tasks.values()]
+        ok = len(calls) == 50 and len(names) == 1 and "_run_and_stop" in names[0]
+        return ok, "{} callbacks ran, {} entries left".format(len(calls), len(names))
+
+
+CHECKS = (high_priority_sleep0, flag_isr_queue_full, idle_wait_unsliced,
+          queue_order_backpressure, queue_cancelled_getter,
+          ride_start_at_file_boundary, late_second_press, profiler_forgets_finished)
+
+
+def main():
+    failed = 0
+    for check in CHECKS:
+        ok, detail = check()
+        print("{} {}: {}".format("ok  " if ok else "FAIL", check.__name__, detail))
+        if not ok:
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
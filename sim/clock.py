@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Virtual time for the simulator.
+
+Time only moves when the firmware sleeps (``utime.sleep*`` or the event
+loop polling for I/O), so hours of riding take as long as the firmware
+needs to compute them. Scheduled events (pin changes and the like) are
+delivered while time moves, in order and at their exact timestamp.
+"""
+
+import heapq
+import time
+
+# MicroPython ports wrap ticks_ms/ticks_us at 2**30
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+# utime.time() counts seconds since 2000-01-01 on MicroPython
+EPOCH = 946684800
+
+
+class SimulationEnd(BaseException):
+    """Raised from a sleep once the simulation reached its end time.
+
+    Derives from BaseException so that it gets through the firmware's
+    ``except Exception`` handlers and ends ``run_forever``.
+    """
+
+
+class VirtualClock(object):
+    """Microsecond clock with an event schedule.
+
+    With ``cpu_scale`` > 0 the host CPU time used between two clock reads
+    is added to virtual time, multiplied by ``cpu_scale``. That roughly
+    models how much slower the ESP32 is than the host, at the cost of
+    runs no longer being deterministic.
+    """
+
+    def __init__(self, start=0, cpu_scale=0.0, wall=1577836800):
+        self.us = start * 1000
+        self.cpu_scale = cpu_scale
+        self.wall = wall - EPOCH
+        self.end = None
+        self.ended = False
+
+        self._events = []
+        self._seq = 0
+        self._idle = []
+        self._host = time.process_time()
+
+    def _charge(self):
+        if self.cpu_scale:
+            elapsed = int((time.process_time() - self._host) * 1000000 * self.cpu_scale)
+            self.us += elapsed
+            # keep the fraction of a microsecond for the next read
+            self._host += elapsed / 1000000.0 / self.cpu_scale
+
+    @property
+    def ms(self):
+        self._charge()
+        return self.us // 1000
+
+    def at(self, ms, callback, *args):
+        """Run callback(*args) once virtual time reaches ms."""
+        self._seq += 1
+        heapq.heappush(self._events, (int(ms * 1000), self._seq, callback, args))
+
+    def after(self, ms, callback, *args):
+        self.at(self.us / 1000.0 + ms, callback, *args)
+
+    def on_idle(self, callback):
+        """Call callback() whenever the firmware is about to sleep."""
+        self._idle.append(callback)
+
+    def stop_at(self, ms):
+        self.end = int(ms * 1000)
+        self.ended = False
+
+    def next_event(self):
+        """Virtual time of the next scheduled event in ms, None if there is none."""
+        if not self._events:
+            return None
+        return self._events[0][0] // 1000
+
+    def advance(self, us):
+        """Move time forward by us microseconds, delivering events on the way."""
+        for callback in self._idle:
+            callback()
+        self._charge()
+
+        target = self.us + max(0, int(us))
+        if self.end is not None and not self.ended and target >= self.end:
+            target = self.end
+
+        events = self._events
+        while events and events[0][0] <= target:
+            due, _, callback, args = heapq.heappop(events)
+            if due > self.us:
+                self.us = due
+            callback(*args)
+        if target > self.us:
+            self.us = target
+        self._host = time.process_time()
+
+        if self.end is not None and not self.ended and self.us >= self.end:
+            self.ended = True
+            raise SimulationEnd()
+
+    # utime
+
+    def ticks_ms(self):
+        self._charge()
+        return (self.us // 1000) & TICKS_MAX
+
+    def ticks_us(self):
+        self._charge()
+        return self.us & TICKS_MAX
+
+    def ticks_add(self, ticks, delta):
+        return (ticks + delta) & TICKS_MAX
+
+    def ticks_diff(self, end, start):
+        return ((end - start + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+    def time(self):
+        self._charge()
+        return self.wall + self.us // 1000000
+
+    def sleep(self, seconds):
+        self.advance(seconds * 1000000)
+
+    def sleep_ms(self, ms):
+        self.advance(ms * 1000)
+
+    def sleep_us(self, us):
+        self.advance(us)
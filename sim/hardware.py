@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""Simulated board: GPIOs, SPI, the SSD1351 OLED and the WS2812 strip."""
+
+import collections
+
+
+class Board(object):
+    """State shared by all Pin/SPI/NeoPixel instances of one simulation.
+
+    Input pins idle high (pull-ups on the reed switch and the KY-040
+    module), inputs are driven with set_input().
+    """
+
+    def __init__(self, clock, record_leds=0):
+        self.clock = clock
+        self.levels = {}
+        self.handlers = {}
+        self.devices = {}
+        self.strips = []
+        self.record_leds = record_leds
+        self.irqs = 0
+
+    def level(self, pin):
+        return self.levels.get(pin, 1)
+
+    def set_input(self, pin, value):
+        """Drive an input pin, calls its IRQ handler on a matching edge."""
+        value = 1 if value else 0
+        old = self.level(pin)
+        self.levels[pin] = value
+        if old == value or pin not in self.handlers:
+            return
+        handler, trigger, obj = self.handlers[pin]
+        edge = Pin.IRQ_RISING if value else Pin.IRQ_FALLING
+        if handler is not None and trigger & edge:
+            self.irqs += 1
+            handler(obj)
+
+    def attach(self, spi_id, device):
+        self.devices[spi_id] = device
+
+    def spi_write(self, spi_id, data):
+        device = self.devices.get(spi_id)
+        if device is not None:
+            device.write(data)
+
+
+class Pin(object):
+    IN = 1
+    OUT = 3
+    OPEN_DRAIN = 7
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    _board = None
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.init(mode, pull, value=value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if value is not None:
+            self.value(value)
+
+    def value(self, value=None):
+        if value is None:
+            return self._board.level(self.id)
+        self._board.levels[self.id] = 1 if value else 0
+
+    __call__ = value
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler=None, trigger=IRQ_RISING | IRQ_FALLING):
+        self._board.handlers[self.id] = (handler, trigger, self)
+
+    def __repr__(self):
+        return "Pin({})".format(self.id)
+
+
+class SPI(object):
+    _board = None
+
+    def __init__(self, id, baudrate=1000000, **kwargs):
+        self.id = id
+        self.baudrate = baudrate
+        self.bytes = 0
+        self.writes = 0
+
+    def init(self, baudrate=None, **kwargs):
+        if baudrate:
+            self.baudrate = baudrate
+
+    def write(self, data):
+        self.bytes += len(data)
+        self.writes += 1
+        self._board.spi_write(self.id, data)
+
+    @property
+    def bus_time(self):
+        """Seconds the bytes written so far took on the wire."""
+        return self.bytes * 8.0 / self.baudrate
+
+    def deinit(self):
+        pass
+
+
+class WDT(object):
+    _board = None
+
+    def __init__(self, id=0, timeout=5000):
+        self.timeout = timeout
+        self.feeds = 0
+
+    def feed(self):
+        self.feeds += 1
+
+
+class NeoPixel(object):
+    """WS2812 strip, every write() is recorded as an LED frame."""
+
+    _board = None
+
+    def __init__(self, pin, n, bpp=3, timing=1):
+        self.pin = pin
+        self.n = n
+        self.bpp = bpp
+        self.pixels = [(0,) * bpp] * n
+        self.writes = 0
+        self.first_write = None # us
+        self.frames = None
+        if self._board.record_leds:
+            self.frames = collections.deque((), self._board.record_leds)
+        self._board.strips.append(self)
+
+    def __len__(self):
+        return self.n
+
+    def __setitem__(self, index, value):
+        self.pixels[index] = tuple(value)
+
+    def __getitem__(self, index):
+        return self.pixels[index]
+
+    def fill(self, color):
+        for i in range(self.n):
+            self.pixels[i] = tuple(color)
+
+    def write(self):
+        self.writes += 1
+        if self.first_write is None:
+            self.first_write = self._board.clock.us
+        if self.frames is not None:
+            self.frames.append((self._board.clock.us // 1000, tuple(self.pixels)))
+
+
+class Panel(object):
+    """SSD1351 model, decodes the command stream into a 128x128 RGB565 framebuffer.
+
+    Only what the driver uses for drawing is modelled: column/row windows,
+    RAM writes and the horizontal/vertical address increment of SET_REMAP.
+    Everything drawn between two idle phases of the firmware makes a frame.
+    """
+
+    SET_COLUMN = 0x15
+    SET_ROW = 0x75
+    WRITE_RAM = 0x5C
+    SET_REMAP = 0xA0
+
+    def __init__(self, board, dc, cs, width=128, height=128, record_frames=0):
+        self.board = board
+        self.dc = dc
+        self.cs = cs
+        self.width = width
+        self.height = height
+        self.ram = bytearray(width * height * 2)
+
+        self._command = None
+        self._args = []
+        self._columns = (0, width - 1)
+        self._rows = (0, height - 1)
+        self._vertical = False
+        self._x = 0
+        self._y = 0
+        self._pending = None
+
+        self.pixels = 0
+        self.first_lit = None # us, first pixel that isn't black
+        self.dirty = False
+        self.frames = 0
+        self.recorded = collections.deque((), record_frames) if record_frames else None
+        self.listeners = []
+
+        board.clock.on_idle(self.idle)
+
+    def write(self, data):
+        if self.board.level(self.cs):
+            return
+        if not self.board.level(self.dc):
+            for command in bytearray(data):
+                self._command = command
+                self._args = []
+                self._pending = None
+                if command == self.WRITE_RAM:
+                    self._x, self._y = self._columns[0], self._rows[0]
+            return
+
+        if self._command == self.WRITE_RAM:
+            self._write_ram(data)
+            return
+
+        self._args.extend(bytearray(data))
+        if self._command == self.SET_COLUMN and len(self._args) >= 2:
+            self._columns = (self._args[0], self._args[1])
+        elif self._command == self.SET_ROW and len(self._args) >= 2:
+            self._rows = (self._args[0], self._args[1])
+        elif self._command == self.SET_REMAP and self._args:
+            self._vertical = bool(self._args[0] & 0x01)
+
+    def _write_ram(self, data):
+        data = bytes(data)
+        if self._pending is not None:
+            data = self._pending + data
+            self._pending = None
+        if len(data) & 1:
+            self._pending = data[-1:]
+            data = data[:-1]
+
+        x0, x1 = self._columns
+        y0, y1 = self._rows
+        x, y = self._x, self._y
+        ram = self.ram
+        width = self.width
+        height = self.height
+        pos = 0
+        while pos < len(data):
+            if self._vertical:
+                if 0 <= x < width and 0 <= y < height:
+                    offset = (y * width + x) * 2
+                    ram[offset:offset + 2] = data[pos:pos + 2]
+                pos += 2
+                y += 1
+                if y > y1:
+                    y = y0
+                    x = x + 1 if x < x1 else x0
+            else:
+                # copy up to the end of the row of the window at once
+                count = max(1, min(x1 - x + 1, (len(data) - pos) // 2))
+                if 0 <= y < height and 0 <= x and x + count <= width:
+                    offset = (y * width + x) * 2
+                    ram[offset:offset + 2 * count] = data[pos:pos + 2 * count]
+                pos += 2 * count
+                x += count
+                if x > x1:
+                    x = x0
+                    y = y + 1 if y < y1 else y0
+        self._x, self._y = x, y
+
+        self.pixels += len(data) // 2
+        if self.first_lit is None and any(data):
+            self.first_lit = self.board.clock.us
+        if not self.dirty:
+            self.dirty = True
+            for listener in self.listeners:
+                listener()
+
+    def idle(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        self.frames += 1
+        if self.recorded is not None:
+            self.recorded.append((self.board.clock.us // 1000, bytes(self.ram)))
+
+    def rgb(self, ram=None):
+        """Framebuffer as 8 bit RGB bytes."""
+        ram = self.ram if ram is None else ram
+        out = bytearray(self.width * self.height * 3)
+        for i in range(self.width * self.height):
+            value = ram[2 * i] << 8 | ram[2 * i + 1]
+            out[3 * i] = (value >> 8) & 0xf8
+            out[3 * i + 1] = (value >> 3) & 0xfc
+            out[3 * i + 2] = (value << 3) & 0xf8
+        return bytes(out)
+
+    def save_ppm(self, path, ram=None):
+        with open(path, "wb") as f:
+            f.write("P6 {} {} 255\n".format(self.width, self.height).encode("ascii"))
+            f.write(self.rgb(ram))
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""MicroPython stand-in modules and the firmware importer.
+
+The firmware is imported from src/ and src/lib/ with a few rewrites so it
+runs on CPython:
+
+  * ``async def`` becomes a plain generator function and ``await`` becomes
+    ``yield from``, which is what MicroPython compiles them to anyway. That
+    way the bundled uasyncio schedules every task the same way it does on
+    the board.
+  * ``import time``, ``utime``, ``machine`` and friends resolve to the
+    simulated board and clock instead of the host's modules.
+  * ``open`` and ``os`` go to a flash directory on the host. Files that are
+    not on the simulated flash are read from src/, like the firmware was
+    copied over.
+"""
+
+import ast
+import builtins
+import collections
+import gc as host_gc
+import heapq
+import importlib.abc
+import importlib.util
+import os
+import random
+import sys
+import traceback
+import tracemalloc
+import types
+
+from sim import hardware
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRMWARE = os.path.join(ROOT, "src")
+
+# CPython objects are a lot bigger than MicroPython's, heap numbers are only
+# meaningful relative to each other
+HEAP_SIZE = 8 * 1024 * 1024
+
+
+class _Generators(ast.NodeTransformer):
+    def visit_AsyncFunctionDef(self, node):
+        self.generic_visit(node)
+        func = ast.FunctionDef(**{field: getattr(node, field, None) for field in ast.FunctionDef._fields})
+        if not _is_generator(func):
+            # an async def without await still is a coroutine
+            func.body.append(ast.If(test=ast.Constant(value=False),
+                                    body=[ast.Expr(value=ast.Yield(value=None))],
+                                    orelse=[]))
+        return ast.fix_missing_locations(ast.copy_location(func, node))
+
+    def visit_Await(self, node):
+        self.generic_visit(node)
+        return ast.copy_location(ast.YieldFrom(value=node.value), node)
+
+
+def _is_generator(func):
+    nodes = list(func.body)
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, (ast.Yield, ast.YieldFrom)):
+            return True
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)):
+            continue
+        nodes.extend(ast.iter_child_nodes(node))
+    return False
+
+
+def compile_firmware(source, path):
+    tree = _Generators().visit(ast.parse(source, path))
+    return compile(tree, path, "exec")
+
+
+class Flash(object):
+    """Flash filesystem backed by a host directory, with src/ as read-only fallback."""
+
+    def __init__(self, root, firmware=FIRMWARE):
+        self.root = root
+        self.firmware = firmware
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def path(self, path, write=False):
+        relative = path.lstrip("/")
+        host = os.path.join(self.root, relative)
+        if write or os.path.exists(host):
+            return host
+        fallback = os.path.join(self.firmware, relative)
+        if os.path.exists(fallback):
+            return fallback
+        return host
+
+    def open(self, path, mode="r", *args, **kwargs):
+        write = any(c in mode for c in "wa+x")
+        f = open(self.path(path, write=write), mode, *args, **kwargs)
+        if "b" in mode and write:
+            return _BinaryFile(f)
+        return f
+
+    def module(self):
+        """uos stand-in."""
+        flash = self
+
+        def listdir(path="/"):
+            names = set()
+            for base in (flash.path(path, write=True), os.path.join(flash.firmware, path.lstrip("/"))):
+                if os.path.isdir(base):
+                    names.update(os.listdir(base))
+            return sorted(names)
+
+        def ilistdir(path="/"):
+            for name in listdir(path):
+                mode = 0x4000 if os.path.isdir(flash.path(path.rstrip("/") + "/" + name)) else 0x8000
+                yield (name, mode, 0)
+
+        def stat(path):
+            return tuple(os.stat(flash.path(path)))[:10]
+
+        def statvfs(path="/"):
+            return (4096, 4096, 512, 256, 256, 0, 0, 0, 0, 255)
+
+        module = types.ModuleType("uos")
+        module.listdir = listdir
+        module.ilistdir = ilistdir
+        module.stat = stat
+        module.statvfs = statvfs
+        module.mkdir = lambda path: os.mkdir(flash.path(path, write=True))
+        module.rmdir = lambda path: os.rmdir(flash.path(path, write=True))
+        module.remove = lambda path: os.remove(flash.path(path, write=True))
+        module.rename = lambda old, new: os.rename(flash.path(old), flash.path(new, write=True))
+        module.sync = lambda: None
+        module.uname = lambda: ("esp32", "sim", "1.12", "sim", "ESP32 module (simulated)")
+        module.urandom = os.urandom
+        return module
+
+
+class _BinaryFile(object):
+    # MicroPython happily writes str to files opened in binary mode
+    def __init__(self, f):
+        self._f = f
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        return self._f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._f.close()
+
+
+class _Deque(object):
+    # ucollections.deque: fixed maxlen, raises IndexError on overflow with flags=1
+    def __init__(self, iterable, maxlen, flags=0):
+        self._items = collections.deque(iterable)
+        self._maxlen = maxlen
+        self._flags = flags
+
+    def append(self, item):
+        if len(self._items) >= self._maxlen:
+            if self._flags & 1:
+                raise IndexError("full")
+            self._items.popleft()
+        self._items.append(item)
+
+    def popleft(self):
+        return self._items.popleft()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __bool__(self):
+        return bool(self._items)
+
+
+class _TimeQueue(object):
+    # utimeq.utimeq
+    def __init__(self, size):
+        self._heap = []
+        self._size = size
+        self._seq = 0
+
+    def push(self, time, callback, args):
+        if len(self._heap) >= self._size:
+            raise IndexError("queue overflow")
+        self._seq += 1
+        heapq.heappush(self._heap, (time, self._seq, callback, args))
+
+    def peektime(self):
+        return self._heap[0][0]
+
+    def pop(self, entry):
+        time, _, callback, args = heapq.heappop(self._heap)
+        entry[0] = time
+        entry[1] = callback
+        entry[2] = args
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class _Poll(object):
+    # uselect.poll, there is no I/O so polling just lets time pass
+    def __init__(self, clock):
+        self._clock = clock
+
+    def register(self, obj, mask=None):
+        pass
+
+    def unregister(self, obj):
+        pass
+
+    def modify(self, obj, mask):
+        pass
+
+    def ipoll(self, timeout=-1, flags=0):
+        if timeout < 0:
+            due = self._clock.next_event()
+            timeout = 1000 if due is None else max(0, due - self._clock.us // 1000)
+        self._clock.sleep_ms(timeout)
+        return ()
+
+    poll = ipoll
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+
+def stand_ins(sim):
+    """Module name -> stand-in module for one simulation."""
+    clock = sim.clock
+    board = sim.board
+
+    utime = _module("utime",
+                    ticks_ms=clock.ticks_ms,
+                    ticks_us=clock.ticks_us,
+                    ticks_cpu=clock.ticks_us,
+                    ticks_add=clock.ticks_add,
+                    ticks_diff=clock.ticks_diff,
+                    time=clock.time,
+                    sleep=clock.sleep,
+                    sleep_ms=clock.sleep_ms,
+                    sleep_us=clock.sleep_us,
+                    localtime=lambda secs=None: tuple(__import__("time").gmtime(
+                        (clock.time() if secs is None else secs) + 946684800))[:8])
+
+    Pin = type("Pin", (hardware.Pin,), {"_board": board})
+    SPI = type("SPI", (hardware.SPI,), {"_board": board})
+    WDT = type("WDT", (hardware.WDT,), {"_board": board})
+    NeoPixel = type("NeoPixel", (hardware.NeoPixel,), {"_board": board})
+
+    def reset():
+        raise SystemExit("machine.reset()")
+
+    machine = _module("machine",
+                      Pin=Pin, SPI=SPI, WDT=WDT,
+                      freq=lambda *args: 240000000,
+                      idle=lambda: None,
+                      reset=reset,
+                      unique_id=lambda: b"\x00sim\x00\x00")
+
+    def schedule(func, arg):
+        # the simulated IRQs run outside of the firmware's code already
+        func(arg)
+        return True
+
+    micropython = _module("micropython",
+                          const=lambda value: value,
+                          native=lambda func: func,
+                          viper=lambda func: func,
+                          schedule=schedule,
+                          alloc_emergency_exception_buf=lambda size: None,
+                          heap_lock=lambda: None,
+                          heap_unlock=lambda: 0,
+                          opt_level=lambda *args: 0,
+                          mem_info=lambda *args: print("mem: total={}".format(HEAP_SIZE)),
+                          stack_use=lambda: 0)
+
+    def mem_alloc():
+        if tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[0]
+        return 0
+
+    gc = _module("gc",
+                 collect=sim.collect,
+                 enable=host_gc.enable,
+                 disable=host_gc.disable,
+                 isenabled=host_gc.isenabled,
+                 mem_alloc=mem_alloc,
+                 mem_free=lambda: max(0, HEAP_SIZE - mem_alloc()),
+                 threshold=sim.threshold)
+
+    def print_exception(exc, file=None):
+        traceback.print_exception(type(exc), exc, exc.__traceback__, file=file or sim.output)
+
+    msys = _module("sys")
+    msys.__dict__.update(sys.__dict__)
+    msys.__dict__.update(platform="esp32", print_exception=print_exception,
+                         stdout=sim.output)
+
+    rng = random.Random(sim.seed)
+    mrandom = _module("random",
+                      getrandbits=rng.getrandbits,
+                      randint=rng.randint,
+                      randrange=rng.randrange,
+                      random=rng.random,
+                      uniform=rng.uniform,
+                      choice=rng.choice,
+                      seed=rng.seed)
+
+    uos = sim.flash.module()
+    uselect = _module("uselect", poll=lambda: _Poll(clock),
+                      POLLIN=1, POLLOUT=4, POLLERR=8, POLLHUP=16)
+
+    modules = dict(
+        utime=utime, time=utime,
+        machine=machine,
+        neopixel=_module("neopixel", NeoPixel=NeoPixel),
+        micropython=micropython,
+        gc=gc,
+        sys=msys,
+        random=mrandom, urandom=mrandom,
+        uos=uos, os=uos,
+        uselect=uselect, select=uselect,
+        ucollections=_module("ucollections", deque=_Deque,
+                             namedtuple=collections.namedtuple,
+                             OrderedDict=collections.OrderedDict),
+        utimeq=_module("utimeq", utimeq=_TimeQueue),
+        uerrno=_module("uerrno", ENOENT=2, EINPROGRESS=115, EAGAIN=11, ETIMEDOUT=110),
+        usocket=_module("usocket"),
+    )
+    # micropython-lib's collections.deque, unbounded unlike ucollections'
+    modules["collections.deque"] = _module("collections.deque", deque=collections.deque)
+    return modules
+
+
+class FirmwareImporter(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    """Imports firmware modules from src/ and src/lib/ for one simulation."""
+
+    def __init__(self, sim, paths):
+        self.sim = sim
+        self.paths = paths
+        self.loaded = []
+
+        self.builtins = dict(builtins.__dict__)
+        self.builtins.update(__import__=self._import,
+                             open=sim.flash.open,
+                             print=sim.print,
+                             const=lambda value: value)
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+        for name in self.loaded:
+            sys.modules.pop(name, None)
+        self.loaded = []
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0:
+            module = self.sim.modules.get(name)
+            if module is not None:
+                return module
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    def find_spec(self, fullname, path=None, target=None):
+        relative = fullname.replace(".", os.sep)
+        for base in self.paths:
+            package = os.path.join(base, relative, "__init__.py")
+            if os.path.isfile(package):
+                return importlib.util.spec_from_file_location(
+                    fullname, package, loader=self,
+                    submodule_search_locations=[os.path.dirname(package)])
+            module = os.path.join(base, relative + ".py")
+            if os.path.isfile(module):
+                return importlib.util.spec_from_file_location(fullname, module, loader=self)
+        return None
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        path = module.__spec__.origin
+        with open(path) as f:
+            code = compile_firmware(f.read(), path)
+        module.__dict__["__builtins__"] = self.builtins
+        self.loaded.append(module.__name__)
+        exec(code, module.__dict__)
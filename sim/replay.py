@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""Replay reed pulse traces into the speedometer on virtual time.
+
+    python3 -m sim.replay --scenario stop-go --bounce 2
+    python3 -m sim.replay --trace ride.csv
+    python3 -m sim.replay --trace pulse0000.bin pulse0001.bin
+
+Feeds a synthetic speed profile or a recorded trace (CSV as written by
+tools/pulsedecode.py, or raw pulse logs) through
+the reed switch IRQ into SwitchCounter and Speedometer, and reports as
+JSON how far the displayed speed is off, how long pulses wait before
+Speedometer.update picks them up and the host CPU spent per pulse.
+"""
+
+import argparse
+import bisect
+import csv
+import json
+import os
+import sys
+import time
+
+from sim import Simulator
+from sim.modules import ROOT
+from sim.simulator import DISTANCE_PER_ROTATION
+
+# (duration ms, speed at start, speed at end in km/h)
+SCENARIOS = {
+    "cruise": ((60000, 35, 35),),
+    "ramp": ((20000, 0, 35), (20000, 35, 35), (20000, 35, 0)),
+    "stop-go": ((10000, 0, 25), (10000, 25, 25), (5000, 25, 0), (5000, 0, 0),
+                (8000, 0, 30), (15000, 30, 30), (6000, 30, 0), (10000, 0, 0)),
+}
+
+MIN_SPEED = 0.5 # km/h, slower counts as standing
+
+# for the stand-ins in bench/fakes.py
+BENCH = os.path.join(ROOT, "bench")
+
+
+class Profile(object):
+    """Piecewise linear speed profile and the pulses it produces."""
+
+    def __init__(self, segments, start=1000):
+        self.start = start
+        self.segments = segments
+        self.duration = sum(segment[0] for segment in segments)
+
+    def speed(self, t):
+        t -= self.start
+        for duration, v0, v1 in self.segments:
+            if t < duration:
+                return v0 + (v1 - v0) * max(0, t) / float(duration)
+            t -= duration
+        return 0.0
+
+    def pulses(self, step=1):
+        # integrate the speed and emit a pulse every wheel circumference
+        timestamps = []
+        position = 0.0
+        t = self.start
+        while t < self.start + self.duration:
+            position += self.speed(t) / 3.6 * step # mm per ms
+            if position >= DISTANCE_PER_ROTATION:
+                position -= DISTANCE_PER_ROTATION
+                timestamps.append(t)
+            t += step
+        return timestamps
+
+
+class Trace(object):
+    """Recorded pulse timestamps, speed derived from the periods."""
+
+    def __init__(self, timestamps, start=1000):
+        offset = start - timestamps[0]
+        self.timestamps = [t + offset for t in timestamps]
+        self.start = start
+        self.duration = self.timestamps[-1] - start
+
+    def speed(self, t):
+        i = bisect.bisect_right(self.timestamps, t)
+        if i == 0 or i >= len(self.timestamps):
+            return 0.0
+        period = self.timestamps[i] - self.timestamps[i - 1]
+        return DISTANCE_PER_ROTATION * 3.6 / period if period > 0 else 0.0
+
+    def pulses(self):
+        return self.timestamps
+
+
+def read_trace(paths):
+    if paths[0].endswith(".csv"):
+        timestamps = []
+        for path in paths:
+            with open(path) as f:
+                for row in csv.DictReader(f):
+                    timestamps.append(int(row["timestamp_ms"]))
+        return timestamps
+
+    sys.path.insert(0, os.path.join(ROOT, "tools"))
+    from pulsedecode import read_pulses
+    return list(read_pulses(paths))
+
+
+def _summary(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return dict(count=len(values),
+                min=values[0],
+                avg=sum(values) / len(values),
+                p95=values[min(len(values) - 1, len(values) * 95 // 100)],
+                max=values[-1])
+
+
+def replay(source, bounce=0, verbose=False):
+    with Simulator(verbose=verbose, paths=[BENCH]) as sim:
+        speedometer = sim.load("speedometer")
+        fakes = sim.load("fakes")
+        asyncio = sim.load("uasyncio")
+
+        pulses = source.pulses()
+        sim.pulses(pulses, bounce=bounce)
+
+        sm = speedometer.Speedometer(persistence=fakes.NoPersistence())
+        counter = sm.counter
+
+        # host CPU in the reed IRQ handler
+        reed = speedometer.REED_PIN.id
+        handler, trigger, pin = sim.board.handlers[reed]
+        irq_cpu = [0.0]
+
+        def timed_handler(pin):
+            start = time.perf_counter()
+            handler(pin)
+            irq_cpu[0] += time.perf_counter() - start
+        sim.board.handlers[reed] = (timed_handler, trigger, pin)
+
+        # how long counted pulses wait for Speedometer.update
+        waits = []
+        process_pulses = sm.process_pulses
+
+        def timed_process_pulses():
+            now = sim.clock.ticks_ms()
+            mask = counter.PULSE_BUFFER - 1
+            for i in range(max(counter._pulse_tail, counter._pulse_head - counter.PULSE_BUFFER),
+                           counter._pulse_head):
+                waits.append(sim.clock.ticks_diff(now, counter._pulses[i & mask]))
+            process_pulses()
+        sm.process_pulses = timed_process_pulses
+
+        # displayed vs. true speed after every update
+        samples = []
+
+        def sample(name, payload):
+            t = sim.clock.us / 1000.0
+            samples.append((t, payload.speed, source.speed(t)))
+        sim.load("events").get_event_bus().sub(speedometer.TOPIC, sample)
+
+        loop = asyncio.get_event_loop()
+        duration = source.start + source.duration + 3000
+        report = sim.run(duration, entry=loop.run_forever)
+
+        errors = [shown - true for _, shown, true in samples]
+        moving = [shown - true for _, shown, true in samples if true >= MIN_SPEED]
+        update_cpu = sum(task["cpu_s"] for task in report["tasks"] if task["name"] == "Speedometer.update")
+        return dict(
+            pulses=len(pulses),
+            counted=sm.revolutions,
+            dropped=len(pulses) - sm.revolutions,
+            virtual_s=report["virtual_s"],
+            host_cpu_s=report["host_cpu_s"],
+            cpu_per_pulse_us=(irq_cpu[0] + update_cpu) * 1000000 / max(1, len(pulses)),
+            irq_cpu_per_pulse_us=irq_cpu[0] * 1000000 / max(1, len(pulses)),
+            update_latency_ms=_summary(waits),
+            speed_error_kmh=dict(
+                samples=len(errors),
+                bias=sum(errors) / len(errors) if errors else 0.0,
+                mean_abs=sum(abs(e) for e in errors) / len(errors) if errors else 0.0,
+                mean_abs_moving=sum(abs(e) for e in moving) / len(moving) if moving else 0.0,
+                max_abs=max(abs(e) for e in errors) if errors else 0.0,
+            ),
+        )
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python3 -m sim.replay", description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="ramp")
+    parser.add_argument("--trace", nargs="+", help="recorded pulses, .csv or pulse log files")
+    parser.add_argument("--bounce", type=int, default=0, help="reed switch bounces per pulse")
+    parser.add_argument("--verbose", action="store_true", help="show the firmware's output")
+    args = parser.parse_args(args)
+
+    if args.trace:
+        source = Trace(read_trace(args.trace))
+    else:
+        source = Profile(SCENARIOS[args.scenario])
+
+    json.dump(replay(source, bounce=args.bounce, verbose=args.verbose), sys.stdout, indent=2, sort_keys=True)
+    print()
+
+
+if __name__ == "__main__":
+    main()
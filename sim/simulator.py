@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""Runs the firmware on the simulated board."""
+
+import collections
+import gc as host_gc
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from sim import hardware, modules
+from sim.clock import SimulationEnd, VirtualClock
+
+# wheel circumference in mm, must match src/speedometer.py
+DISTANCE_PER_ROTATION = 2 * 3.14159 * 100.0
+
+PULSE_WIDTH = 5     # ms the magnet keeps the reed switch closed
+DETENT_INTERVAL = 4 # ms between the four edges of one encoder detent
+
+
+class HostProfiler(object):
+    # EventLoop.monitor measuring host CPU per task, chains like
+    # uasyncio.watchdog.LoopWatchdog
+    def __init__(self):
+        self.tasks = collections.defaultdict(lambda: [0, 0.0, 0.0])
+        self._next = None
+        self._started = 0.0
+
+    def install(self, loop):
+        self._next = loop.monitor
+        loop.monitor = self
+        return self
+
+    def wake(self, task, t):
+        if self._next is not None:
+            self._next.wake(task, t)
+
+    def start(self, task):
+        if self._next is not None:
+            self._next.start(task)
+        self._started = time.perf_counter()
+
+    def stop(self, task):
+        elapsed = time.perf_counter() - self._started
+        if self._next is not None:
+            self._next.stop(task)
+        stats = self.tasks[getattr(task, "__qualname__", repr(task))]
+        stats[0] += 1
+        stats[1] += elapsed
+        if elapsed > stats[2]:
+            stats[2] = elapsed
+
+    def done(self, task):
+        if self._next is not None:
+            self._next.done(task)
+
+    def report(self):
+        # name -> (slices, total s, max slice s), most expensive first
+        return sorted(((name, tuple(stats)) for name, stats in self.tasks.items()),
+                      key=lambda item: -item[1][1])
+
+
+class Simulator(object):
+    """The firmware on a simulated board, on virtual time.
+
+    Usage:
+
+        with Simulator() as sim:
+            sim.ride(speed=25, start=5000, duration=10 * 60 * 1000)
+            sim.click(at=20000)
+            report = sim.run(15 * 60 * 1000)
+
+    Inputs are scheduled up front (or from callbacks registered with
+    ``at``), then ``run`` calls ``main.main()`` until the given amount of
+    virtual time has passed. IRQ handlers run whenever the firmware sleeps
+    or polls, the way soft IRQs on the ESP32 run between bytecodes.
+    """
+
+    def __init__(self, flash=None, firmware=modules.FIRMWARE, seed=0, verbose=False,
+                 record_frames=0, record_leds=0, trace_memory=False, cpu_scale=0.0, paths=()):
+        self.clock = VirtualClock(cpu_scale=cpu_scale)
+        self.board = hardware.Board(self.clock, record_leds=record_leds)
+        self.seed = seed
+
+        self._tmp = None
+        if flash is None:
+            flash = self._tmp = tempfile.mkdtemp(prefix="c3scooter-flash-")
+        self.flash = modules.Flash(flash, firmware)
+        for directory in ("data",):
+            if not os.path.isdir(os.path.join(flash, directory)):
+                os.mkdir(os.path.join(flash, directory))
+
+        self.output = sys.stdout if verbose else open(os.devnull, "w")
+        self.lines = 0
+
+        self.collections = 0
+        self.collect_time = 0.0
+        self._threshold = -1
+
+        self.trace_memory = trace_memory
+        self.record_frames = record_frames
+        self.profiler = HostProfiler()
+        self.loop = None
+        self.panel = None
+
+        # encoder/button -> next display write latency, in virtual ms
+        self.latencies = collections.defaultdict(list)
+        self._inputs = []
+
+        self.modules = modules.stand_ins(self)
+        self.importer = modules.FirmwareImporter(
+            self, [firmware, os.path.join(firmware, "lib")] + list(paths))
+        self.importer.install()
+
+        self._hook_loop()
+        self._hook_display()
+
+    def close(self):
+        self.importer.uninstall()
+        if self.output is not sys.stdout:
+            self.output.close()
+        if self._tmp is not None:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+            self._tmp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def load(self, name):
+        """Import a firmware module."""
+        return __import__(name, fromlist=("__name__",))
+
+    # firmware facing
+
+    def print(self, *args, **kwargs):
+        self.lines += 1
+        kwargs["file"] = kwargs.get("file") or self.output
+        print(*args, **kwargs)
+
+    def collect(self):
+        start = time.perf_counter()
+        host_gc.collect()
+        self.collect_time += time.perf_counter() - start
+        self.collections += 1
+
+    def threshold(self, amount=None):
+        if amount is None:
+            return self._threshold
+        self._threshold = amount
+
+    def _hook_loop(self):
+        # every event loop the firmware creates gets the host profiler
+        core = self.load("uasyncio.core")
+        self.load("uasyncio")
+        base = core._event_loop_class
+        sim = self
+
+        class SimEventLoop(base):
+            def __init__(self, *args):
+                base.__init__(self, *args)
+                sim.loop = self
+                sim.profiler.install(self)
+
+        core._event_loop_class = SimEventLoop
+
+    def _hook_display(self):
+        display = self.load("display")
+        self.panel = hardware.Panel(self.board, dc=display.PIN_DISPLAY_DC,
+                                    cs=display.PIN_DISPLAY_CS,
+                                    record_frames=self.record_frames)
+        self.panel.listeners.append(self._drawn)
+        # SPI bus the driver is created on in display.ScooterDisplay
+        self.board.attach(2, self.panel)
+
+    def _drawn(self):
+        now = self.clock.us
+        for kind, t in self._inputs:
+            self.latencies[kind].append((now - t) / 1000.0)
+        self._inputs = []
+
+    def _input(self, kind):
+        self._inputs.append((kind, self.clock.us))
+
+    # inputs
+
+    def at(self, ms, callback, *args):
+        """Call callback(*args) at virtual time ms."""
+        self.clock.at(ms, callback, *args)
+
+    def every(self, interval, callback, start=0):
+        """Call callback() every interval ms of virtual time."""
+        def tick(ms):
+            callback()
+            self.clock.at(ms + interval, tick, ms + interval)
+        self.clock.at(start, tick, start)
+
+    def pin(self, pin, value, at):
+        self.clock.at(at, self.board.set_input, pin, value)
+
+    def pulse(self, at, bounce=0):
+        """One wheel revolution: the reed switch closes for PULSE_WIDTH ms.
+
+        With bounce > 0 the contact chatters that many times first.
+        """
+        reed = self.load("speedometer").REED_PIN.id
+        t = at
+        for _ in range(bounce):
+            self.pin(reed, 0, t)
+            self.pin(reed, 1, t + 0.2)
+            t += 0.5
+        self.pin(reed, 0, t)
+        self.pin(reed, 1, t + PULSE_WIDTH)
+
+    def pulses(self, timestamps, bounce=0):
+        for t in timestamps:
+            self.pulse(t, bounce=bounce)
+
+    def ride(self, speed, start, duration, bounce=0):
+        """Ride at a constant speed (km/h), returns the pulse timestamps."""
+        period = DISTANCE_PER_ROTATION * 3.6 / speed
+        timestamps = []
+        t = start
+        while t < start + duration:
+            timestamps.append(t)
+            t += period
+        self.pulses(timestamps, bounce=bounce)
+        return timestamps
+
+    def turn(self, detents, at, interval=100):
+        """Turn the encoder, positive detents are clockwise for the rotary driver."""
+        display = self.load("display")
+        clk, dt = display.PIN_KNOB_CLK, display.PIN_KNOB_DT
+        if detents > 0:
+            edges = ((dt, 0), (clk, 0), (dt, 1), (clk, 1))
+        else:
+            edges = ((clk, 0), (dt, 0), (clk, 1), (dt, 1))
+        t = at
+        for _ in range(abs(detents)):
+            self.clock.at(t, self._input, "encoder")
+            for i, (pin, value) in enumerate(edges):
+                self.pin(pin, value, t + i * DETENT_INTERVAL)
+            t += interval
+
+    def press(self, at, duration=100):
+        switch = self.load("display").PIN_KNOB_SWITCH
+        self.clock.at(at, self._input, "button")
+        self.pin(switch, 0, at)
+        self.pin(switch, 1, at + duration)
+
+    def click(self, at):
+        self.press(at, 100)
+
+    def double_click(self, at):
+        self.press(at, 80)
+        self.press(at + 200, 80)
+
+    def long_press(self, at):
+        self.press(at, 1500)
+
+    # running
+
+    def run(self, duration, entry=None):
+        """Run entry() (main.main() by default) for duration ms of virtual time."""
+        if entry is None:
+            entry = self.load("main").main
+        if self.trace_memory:
+            tracemalloc.start()
+
+        self.clock.stop_at(self.clock.us // 1000 + duration)
+        start_ms = self.clock.us // 1000
+        start = time.process_time()
+        try:
+            entry()
+        except SimulationEnd:
+            pass
+        finally:
+            self.cpu = time.process_time() - start
+            self.elapsed = self.clock.us // 1000 - start_ms
+            if self.trace_memory:
+                self.memory = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+        return self.report()
+
+    def report(self):
+        """Everything measured, as plain data."""
+        leds = [strip.writes for strip in self.board.strips]
+        latencies = {}
+        for kind, values in self.latencies.items():
+            values = sorted(values)
+            latencies[kind] = dict(count=len(values),
+                                   min=values[0],
+                                   avg=sum(values) / len(values),
+                                   p95=values[min(len(values) - 1, len(values) * 95 // 100)],
+                                   max=values[-1])
+        report = dict(
+            virtual_s=self.elapsed / 1000.0,
+            host_cpu_s=self.cpu,
+            speedup=self.elapsed / 1000.0 / self.cpu if self.cpu else None,
+            display_frames=self.panel.frames,
+            display_pixels=self.panel.pixels,
+            led_frames=sum(leds),
+            irqs=self.board.irqs,
+            output_lines=self.lines,
+            gc_collections=self.collections,
+            gc_time_s=self.collect_time,
+            input_latency_ms=latencies,
+            tasks=[dict(name=name, slices=slices, cpu_s=total, max_slice_s=longest)
+                   for name, (slices, total, longest) in self.profiler.report()],
+        )
+        if self.panel.first_lit is not None:
+            report["first_pixel_ms"] = self.panel.first_lit / 1000.0
+        first_leds = [strip.first_write for strip in self.board.strips if strip.first_write is not None]
+        if first_leds:
+            report["first_led_frame_ms"] = min(first_leds) / 1000.0
+        if self.loop is not None:
+            stats = self.loop.queue_stats()
+            report["queues"] = dict(runq_len=stats[0], runq_hwm=stats[1], runq_overflows=stats[2],
+                                    waitq_len=stats[3], waitq_hwm=stats[4], waitq_overflows=stats[5])
+        if self.trace_memory:
+            report["memory"] = dict(current=self.memory[0], peak=self.memory[1])
+        return report
+
+    def save_frames(self, directory):
+        """Write the recorded display frames as PPM images."""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        paths = []
+        for t, ram in self.panel.recorded or ():
+            path = os.path.join(directory, "frame-{:09d}.ppm".format(t))
+            self.panel.save_ppm(path, ram)
+            paths.append(path)
+        return paths
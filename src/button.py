@@ -0,0 +1,146 @@
+from machine import Pin
+
+import uasyncio as asyncio
+from uasyncio.synchro import Flag
+from aswitch import launch
+
+import memstat
+import time
+
+class Pushbutton(object):
+    # Drop-in for aswitch.Pushbutton: edges are reported by pin IRQ and
+    # debounced by timestamp, long press and double click are timed by a
+    # single task waiting on the flag with a timeout. Nothing polls and
+    # nothing allocates per press.
+    debounce_ms = 50
+    long_press_ms = 1000
+    double_click_ms = 400
+
+    def __init__(self, pin, suppress=False):
+        self.pin = pin
+        self._supp = suppress
+
+        self._tf = False
+        self._ta = ()
+        self._ff = False
+        self._fa = ()
+        self._df = False
+        self._da = ()
+        self._lf = False
+        self._la = ()
+
+        self._edge = time.ticks_ms()
+        self._long_deadline = None
+        self._double_deadline = None
+        self._dblran = False
+
+        self.sense = pin.value()
+        self.state = self.rawstate()
+
+        self._flag = Flag()
+        pin.irq(trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, handler=self._irq)
+
+        loop = asyncio.get_event_loop()
+        task = self.buttoncheck()
+        memstat.tag(task, memstat.INPUT)
+        loop.create_task(task, asyncio.PRIORITY_HIGH)
+
+    def press_func(self, func, args=()):
+        self._tf = func
+        self._ta = args
+
+    def release_func(self, func, args=()):
+        self._ff = func
+        self._fa = args
+
+    def double_func(self, func, args=()):
+        self._df = func
+        self._da = args
+
+    def long_func(self, func, args=()):
+        self._lf = func
+        self._la = args
+
+    # Current non-debounced logical button state: True == pressed
+    def rawstate(self):
+        return bool(self.pin.value() ^ self.sense)
+
+    # Current debounced state of button (True == pressed)
+    def __call__(self):
+        return self.state
+
+    def _irq(self, pin):
+        self._edge = time.ticks_ms()
+        # pin IRQs are soft on the ESP32, already scheduled
+        self._flag.set()
+
+    def _timeout(self, now):
+        # time until the next pending deadline, -1 if there is none
+        timeout = -1
+        if self._long_deadline is not None:
+            timeout = max(0, time.ticks_diff(self._long_deadline, now))
+        if self._double_deadline is not None:
+            remaining = max(0, time.ticks_diff(self._double_deadline, now))
+            if timeout < 0 or remaining < timeout:
+                timeout = remaining
+        return timeout
+
+    def _pressed(self, now):
+        if self._tf:
+            launch(self._tf, self._ta)
+        if self._lf:
+            self._long_deadline = time.ticks_add(now, self.long_press_ms)
+        if self._df:
+            if self._double_deadline is not None:
+                # second click within the double click time
+                self._double_deadline = None
+                self._dblran = True
+                launch(self._df, self._da)
+            else:
+                self._double_deadline = time.ticks_add(now, self.double_click_ms)
+
+    def _released(self):
+        if self._ff:
+            if not self._supp:
+                launch(self._ff, self._fa)
+            elif self._double_deadline is None and not self._dblran:
+                if not self._lf or self._long_deadline is not None:
+                    launch(self._ff, self._fa)
+        # avoid interpreting a second click as a long push
+        self._long_deadline = None
+        self._dblran = False
+
+    def _expire(self, now):
+        if self._long_deadline is not None and time.ticks_diff(now, self._long_deadline) >= 0:
+            self._long_deadline = None
+            launch(self._lf, self._la)
+
+        if self._double_deadline is not None and time.ticks_diff(now, self._double_deadline) >= 0:
+            # no double click happened, deliver a suppressed release now
+            self._double_deadline = None
+            if self._supp and not self.state and self._long_deadline is None:
+                launch(self._ff, self._fa)
+
+    async def buttoncheck(self):
+        while True:
+            if await self._flag.wait(self._timeout(time.ticks_ms())):
+                # let the contacts settle before sampling the level
+                settle = self.debounce_ms - time.ticks_diff(time.ticks_ms(), self._edge)
+                while settle > 0:
+                    await asyncio.sleep_ms(settle)
+                    settle = self.debounce_ms - time.ticks_diff(time.ticks_ms(), self._edge)
+                self._flag.clear()
+
+                # deadlines that passed before this edge come first, a
+                # second press after the double click time is no double
+                now = time.ticks_ms()
+                self._expire(now)
+                state = self.rawstate()
+                if state != self.state:
+                    self.state = state
+                    if state:
+                        self._pressed(now)
+                    else:
+                        self._released()
+
+            self._expire(time.ticks_ms())
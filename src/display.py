@@ -1,4 +1,4 @@
-from aswitch import Pushbutton
+from button import Pushbutton
 from rotary_irq_esp import RotaryIRQ
 
 from machine import Pin, SPI
@@ -6,7 +6,12 @@ from ssd1351 import Display, color565
 from xglcd_font import XglcdFont
 
 import uasyncio as asyncio
+from uasyncio.synchro import Flag
 
+import array
+import events
+import kernels
+import memstat
 import time
 
 PIN_DISPLAY_MOSI = 27
@@ -19,43 +24,286 @@ PIN_KNOB_CLK = 18
 PIN_KNOB_DT = 23
 PIN_KNOB_SWITCH = 19
 
-FONT_UNISPACE = XglcdFont("fonts/Unispace12x24.c", 12, 24)
-FONT_FIXED = XglcdFont("fonts/FixedFont5x8.c", 5, 7)
+TOPIC_REDRAW = "display.redraw"
+
+# theme, RGB565
+BACKGROUND = color565(0, 0, 0)
+LABEL = color565(255, 255, 255)
+VALUE = color565(0, 255, 0)
+
+# bytes per fill buffer, one colour, 1024 pixels per SPI block
+FILL_BYTES = 2048
+
+# parsing the fonts takes a while, load_fonts() does it once the logo is up
+FONT_UNISPACE = None
+FONT_FIXED = None
+
+def load_fonts():
+    global FONT_UNISPACE, FONT_FIXED
+    if FONT_UNISPACE is not None:
+        return
+    try:
+        # frozen into the firmware by freeze/, used straight from flash
+        import font_unispace12x24
+        import font_fixed5x8
+        FONT_UNISPACE = XglcdFont(None, 12, 24, letters=font_unispace12x24.LETTERS)
+        FONT_FIXED = XglcdFont(None, 5, 7, letters=font_fixed5x8.LETTERS)
+    except ImportError:
+        FONT_UNISPACE = XglcdFont("fonts/Unispace12x24.c", 12, 24)
+        FONT_FIXED = XglcdFont("fonts/FixedFont5x8.c", 5, 7)
 
 class RotaryEncoder(object):
-    def __init__(self, pin_clk, pin_dt, delay=100, cw=None, ccw=None):
+    EVENT_BUFFER = 16 # must be a power of two
+
+    # (max ms since the previous detent, step multiplier)
+    ACCELERATION = ((25, 8), (50, 4), (100, 2))
+
+    def __init__(self, pin_clk, pin_dt, cw=None, ccw=None):
         self._rotary = RotaryIRQ(pin_clk, pin_dt)
-        self._delay = delay
+
+        # ring of detents (timestamp, direction) filled by the IRQ,
+        # check() sleeps on the flag until there is something in it
+        self._times = array.array("i", [0] * self.EVENT_BUFFER)
+        self._directions = array.array("b", [0] * self.EVENT_BUFFER)
+        self._head = 0
+        self._tail = 0
+        self.dropped = 0
+
+        self._flag = Flag()
+        self._rotary.set_listener(self._irq)
 
         self._cb_cw = cw
         self._cb_ccw = ccw
 
+        # of the last delivered detent, in detents per second
+        self.velocity = 0
+
         loop = asyncio.get_event_loop()
-        loop.create_task(self.check())
+        task = self.check()
+        memstat.tag(task, memstat.INPUT)
+        loop.create_task(task, asyncio.PRIORITY_HIGH)
+
+    def _irq(self, incr):
+        index = self._head & (self.EVENT_BUFFER - 1)
+        self._times[index] = time.ticks_ms()
+        self._directions[index] = incr
+        self._head += 1
+        # pin IRQs are soft on the ESP32, already scheduled
+        self._flag.set()
+
+    def multiplier(self, interval):
+        for max_interval, multiplier in self.ACCELERATION:
+            if interval <= max_interval:
+                return multiplier
+        return 1
 
     async def check(self):
-        old_value = 0
+        last_time = time.ticks_ms()
+        last_direction = 0
 
         while True:
-            new_value = self._rotary.value()
-            difference = abs(new_value - old_value)
-
-            if new_value > old_value and callable(self._cb_ccw):
-                self._cb_ccw(difference)
-            elif old_value > new_value and callable(self._cb_cw):
-                self._cb_cw(difference)
-
-            old_value = new_value
-
-            await asyncio.sleep_ms(self._delay)
+            await self._flag.wait()
+
+            if self._head - self._tail > self.EVENT_BUFFER:
+                self.dropped += self._head - self._tail - self.EVENT_BUFFER
+                self._tail = self._head - self.EVENT_BUFFER
+
+            while self._tail != self._head:
+                index = self._tail & (self.EVENT_BUFFER - 1)
+                self._tail += 1
+
+                timestamp = self._times[index]
+                direction = self._directions[index]
+
+                # detents in the same ms are the fastest there is
+                interval = max(time.ticks_diff(timestamp, last_time), 1)
+                if direction != last_direction:
+                    # changing direction starts over slowly
+                    interval = 1000
+                last_time = timestamp
+                last_direction = direction
+
+                self.velocity = 1000 // interval
+                steps = self.multiplier(interval)
+                if direction > 0 and callable(self._cb_ccw):
+                    self._cb_ccw(steps, self.velocity)
+                elif direction < 0 and callable(self._cb_cw):
+                    self._cb_cw(steps, self.velocity)
+
+def format_number(buf, value, decimals=2):
+    # Writes the integer value / 10**decimals like "{:.2f}" as ASCII into
+    # buf and returns the length. Callers pass scaled ints (km/h * 100),
+    # so no float gets boxed on the way.
+    n = value
+    negative = n < 0
+    if negative:
+        n = -n
+
+    # digits backwards, then reverse
+    i = 0
+    while i < decimals:
+        buf[i] = 48 + n % 10
+        n //= 10
+        i += 1
+    if decimals:
+        buf[i] = 46 # .
+        i += 1
+    while True:
+        buf[i] = 48 + n % 10
+        n //= 10
+        i += 1
+        if not n:
+            break
+    if negative:
+        buf[i] = 45 # -
+        i += 1
+
+    j = 0
+    k = i - 1
+    while j < k:
+        buf[j], buf[k] = buf[k], buf[j]
+        j += 1
+        k -= 1
+    return i
 
 class SafeDisplay(Display):
+    # Clips text at the right edge and draws text and fills without
+    # allocating: fills are cut from one preallocated buffer per colour,
+    # letters are rendered into a reused glyph buffer and commands go out
+    # from fixed buffers. The memoryviews handed to SPI are cached per
+    # length, so only the first draw of a size allocates.
+    def __init__(self, spi, cs, dc, rst, width=128, height=128):
+        self._command = bytearray(1)
+        self._window = bytearray(2)
+        self._fills = dict()
+        self._glyph = bytearray(0)
+        self._glyph_views = dict()
+        self._glyph_params = array.array("H", (0, 0, 0, 0))
+        self._fill(BACKGROUND, FILL_BYTES)
+        Display.__init__(self, spi, cs, dc, rst, width=width, height=height)
+
+    def _fill(self, color, size):
+        fill = self._fills.get(color)
+        if fill is None:
+            buf = bytearray(FILL_BYTES)
+            kernels.fill(buf, color, FILL_BYTES // 2)
+            fill = (memoryview(buf), dict())
+            self._fills[color] = fill
+        view = fill[1].get(size)
+        if view is None:
+            view = fill[0][:size]
+            fill[1][size] = view
+        return view
+
+    def _write_cmd(self, command, data=None):
+        self._command[0] = command
+        self.dc(0)
+        self.cs(0)
+        self.spi.write(self._command)
+        self.cs(1)
+        if data is not None:
+            self.write_data(data)
+
+    def block(self, x0, y0, x1, y1, data):
+        window = self._window
+        window[0] = x0
+        window[1] = x1
+        self._write_cmd(self.SET_COLUMN, window)
+        window[0] = y0
+        window[1] = y1
+        self._write_cmd(self.SET_ROW, window)
+        self._write_cmd(self.WRITE_RAM)
+        self.write_data(data)
+
+    def clear(self, color=0):
+        line = self._fill(color, FILL_BYTES)
+        for x in range(0, self.width, 8):
+            self.block(x, 0, x + 7, self.height - 1, line)
+
+    def fill_hrect(self, x, y, w, h, color):
+        if self.is_off_grid(x, y, x + w - 1, y + h - 1):
+            return
+        chunk_height = FILL_BYTES // 2 // w
+        while h > 0:
+            rows = min(h, chunk_height)
+            self.block(x, y, x + w - 1, y + rows - 1, self._fill(color, rows * w * 2))
+            y += rows
+            h -= rows
+
+    def fill_vrect(self, x, y, w, h, color):
+        if self.is_off_grid(x, y, x + w - 1, y + h - 1):
+            return
+        chunk_width = FILL_BYTES // 2 // h
+        while w > 0:
+            columns = min(w, chunk_width)
+            self.block(x, y, x + columns - 1, y + h - 1, self._fill(color, columns * h * 2))
+            x += columns
+            w -= columns
+
+    def _draw_letter(self, x, y, code, font, color, background):
+        # portrait only, returns the letter width
+        size = font.width * font.height * 2
+        if len(self._glyph) < size:
+            self._glyph = bytearray(size)
+            self._glyph_views = dict()
+
+        letter_ord = code - font.start_letter
+        if letter_ord < 0 or letter_ord >= font.letter_count:
+            return 0
+        h = font.height
+        params = self._glyph_params
+        params[kernels.GLYPH_HEIGHT] = h
+        params[kernels.GLYPH_HEIGHT_BYTES] = (font.bytes_per_letter - 1) // font.width
+        params[kernels.GLYPH_COLOR] = color
+        params[kernels.GLYPH_BACKGROUND] = background
+        w = kernels.glyph(self._glyph, font.letters, letter_ord * font.bytes_per_letter, params)
+        if w == 0 or self.is_off_grid(x, y, x + w - 1, y + h - 1):
+            return w
+
+        size = w * h * 2
+        view = self._glyph_views.get(size)
+        if view is None:
+            view = memoryview(self._glyph)[:size]
+            self._glyph_views[size] = view
+
+        self._write_cmd(self.SET_REMAP, b"\x75") # Vertical address increment
+        self.block(x, y, x + w - 1, y + h - 1, view)
+        self._write_cmd(self.SET_REMAP, b"\x74") # Switch back to horizontal
+        return w
+
+    def draw_letter(self, x, y, letter, font, color, background=0,
+                    landscape=False):
+        if landscape:
+            return Display.draw_letter(self, x, y, letter, font, color, background, landscape)
+        return self._draw_letter(x, y, ord(letter), font, color, background), font.height
+
     def draw_text(self, x, y, text, font, color,  background=0,
-                  landscape=False, spacing=1):
+                  landscape=False, spacing=1, length=None):
+        # text can also be a bytearray, with length the number of bytes used
+        if length is None:
+            length = len(text)
         max_length = (self.width - x + spacing) // (font.width + spacing)
-        text = text[0:min(max_length, len(text))]
-        Display.draw_text(self, x, y, text, font, color, background=background,
-                          landscape=landscape, spacing=spacing)
+        if length > max_length:
+            length = max_length
+
+        if landscape:
+            text = text[0:length]
+            if not isinstance(text, str):
+                text = str(text, "ascii")
+            Display.draw_text(self, x, y, text, font, color, background=background,
+                              landscape=landscape, spacing=spacing)
+            return
+
+        h = font.height
+        chars = isinstance(text, str)
+        for i in range(length):
+            w = self._draw_letter(x, y, ord(text[i]) if chars else text[i], font, color, background)
+            if w == 0:
+                print('Invalid width {0} or height {1}'.format(w, h))
+                return
+            if spacing:
+                self.fill_vrect(x + w, y, spacing, h, background)
+            x += w + spacing
 
 
 class DisplayScreen(object):
@@ -70,10 +318,13 @@ class DisplayScreen(object):
     def update(self, display, needs_full_redraw=False):
         pass
 
-    def encoder_cw(self, steps):
+    def redraw(self, name=None, payload=None):
+        events.get_event_bus().pub(TOPIC_REDRAW)
+
+    def encoder_cw(self, steps, velocity=0):
         pass
 
-    def encoder_ccw(self, steps):
+    def encoder_ccw(self, steps, velocity=0):
         pass
 
     def encoder_click(self):
@@ -104,19 +355,31 @@ class DemoScreen(DisplayScreen):
         if self.y > 100:
             self.y = 0
 
+def open_display():
+    spi = SPI(2, baudrate=14500000, sck=Pin(PIN_DISPLAY_CLK), mosi=Pin(PIN_DISPLAY_MOSI))
+    return SafeDisplay(spi, dc=Pin(PIN_DISPLAY_DC), cs=Pin(PIN_DISPLAY_CS), rst=Pin(PIN_DISPLAY_RST))
+
 class ScooterDisplay(object):
-    def __init__(self, screens):
+    PIXEL_SHIFT_CHECK = 10 * 1000 # 10s
+
+    def __init__(self, screens, oled=None):
         self.screens = screens
         if not self.screens:
             self.screens = [DemoScreen()]
         self._screen = 0
+        load_fonts()
 
-        # OLED
-        spi = SPI(2, baudrate=14500000, sck=Pin(PIN_DISPLAY_CLK), mosi=Pin(PIN_DISPLAY_MOSI))
-        self.display = SafeDisplay(spi, dc=Pin(PIN_DISPLAY_DC), cs=Pin(PIN_DISPLAY_CS), rst=Pin(PIN_DISPLAY_RST))
+        # OLED, one handed over is already showing the first screen
+        self.display = oled or open_display()
+        self._showing = oled is not None
+
+        self._bus = events.get_event_bus()
+        self._bus.topic(TOPIC_REDRAW, coalesce=True)
 
         loop = asyncio.get_event_loop()
-        loop.create_task(self.update_display())
+        for task in (self.update_display(), self.check_pixel_shift()):
+            memstat.tag(task, memstat.DISPLAY)
+            loop.create_task(task)
 
         # Encoder rotation
         self.encoder = RotaryEncoder(PIN_KNOB_CLK, PIN_KNOB_DT, cw=self.encoder_cw, ccw=self.encoder_ccw)
@@ -127,33 +390,39 @@ class ScooterDisplay(object):
         self.button.double_func(self.encoder_dblpush)
         self.button.long_func(self.encoder_longpush)
 
-    def encoder_cw(self, steps):
-        print("DISPLAY: Encoder CW, {} steps".format(steps))
+    def encoder_cw(self, steps, velocity=0):
+        # one screen per detent, the step multiplier is meant for scrolling
+        print("DISPLAY: Encoder CW, {} steps, {}/s".format(steps, velocity))
         self._screen += 1
         if self._screen > len(self.screens) - 1:
             self._screen = 0
+        self._bus.pub(TOPIC_REDRAW)
 
-    def encoder_ccw(self, steps):
-        print("DISPLAY: Encoder CCW, {} steps".format(steps))
+    def encoder_ccw(self, steps, velocity=0):
+        print("DISPLAY: Encoder CCW, {} steps, {}/s".format(steps, velocity))
         self._screen -= 1
         if self._screen < 0:
             self._screen = len(self.screens) - 1
+        self._bus.pub(TOPIC_REDRAW)
 
     def encoder_push(self):
         print("DISPLAY: Encoder PUSH")
         self.screens[self._screen].encoder_click()
+        self._bus.pub(TOPIC_REDRAW)
 
     def encoder_dblpush(self):
         print("DISPLAY: Encoder DBLPUSH")
         self.screens[self._screen].encoder_dblclick()
+        self._bus.pub(TOPIC_REDRAW)
 
     def encoder_longpush(self):
         print("DISPLAY: Encoder LONGPUSH")
         self.screens[self._screen].encoder_longpress()
+        self._bus.pub(TOPIC_REDRAW)
 
     async def update_display(self):
         current_screen = self._screen
-        screen_changed = True
+        screen_changed = not self._showing
         needs_pixel_shift = False
 
         while True:
@@ -164,7 +433,13 @@ class ScooterDisplay(object):
 
             self.screens[self._screen].update(self.display, needs_full_redraw=screen_changed or needs_pixel_shift)
             current_screen = self._screen
-            await asyncio.sleep_ms(1000)
+            await self._bus.wait(TOPIC_REDRAW)
 
             screen_changed = current_screen != self._screen
             needs_pixel_shift = self.screens[self._screen].needs_pixel_shift()
+
+    async def check_pixel_shift(self):
+        while True:
+            await asyncio.sleep_ms(self.PIXEL_SHIFT_CHECK)
+            if self.screens[self._screen].needs_pixel_shift():
+                self._bus.pub(TOPIC_REDRAW)
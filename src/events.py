@@ -1,18 +1,152 @@
+import sys
+
+import uasyncio as asyncio
+
+import memstat
+
+MAX_SUBSCRIBERS = 4
+
+class Topic(object):
+    def __init__(self, name, coalesce=False, max_subscribers=MAX_SUBSCRIBERS):
+        self.name = name
+        # coalescing topics only deliver the latest payload, from the
+        # dispatcher task instead of from within pub()
+        self.coalesce = coalesce
+
+        self.callbacks = [None] * max_subscribers
+        self.waiters = [None] * max_subscribers
+
+        self.payload = None
+        self.pending = False
+
+        # counters
+        self.published = 0
+        self.delivered = 0
+        self.coalesced = 0
+        self.errors = 0
+
 class EventBus(object):
-    subscriptions = dict()
+    def __init__(self):
+        self._topics = dict()
+        self._coalescing = []
+
+        self._loop = asyncio.get_event_loop()
+        self._pending = False
+        self._parked = False
+        self._dispatcher = self._dispatch()
+        memstat.tag(self._dispatcher, memstat.EVENTS)
+        self._loop.create_task(self._dispatcher)
+
+    def topic(self, name, coalesce=False, max_subscribers=MAX_SUBSCRIBERS):
+        topic = self._topics.get(name)
+        if topic is None:
+            topic = Topic(name, coalesce=coalesce, max_subscribers=max_subscribers)
+            self._topics[name] = topic
+            if coalesce:
+                self._coalescing.append(topic)
+        return topic
+
+    def pub(self, name, payload=None):
+        topic = self._topics.get(name)
+        if topic is None:
+            # nobody ever subscribed or declared it
+            return
 
-    def pub(event, payload):
-        callbacks = EventBus.subscriptions.get(event, list())
-        for callback in callbacks:
+        topic.published += 1
+        if not topic.coalesce:
+            topic.payload = payload
+            self._deliver(topic)
+            return
+
+        if topic.pending:
+            topic.coalesced += 1
+        topic.payload = payload
+        topic.pending = True
+
+        self._pending = True
+        if self._parked:
+            self._parked = False
+            self._loop.call_soon(self._dispatcher)
+
+    def sub(self, name, callback):
+        topic = self.topic(name)
+        callbacks = topic.callbacks
+        for i in range(len(callbacks)):
+            if callbacks[i] is None:
+                callbacks[i] = callback
+                return
+        raise ValueError("Too many subscribers for {}".format(name))
+
+    def unsub(self, name, callback):
+        topic = self._topics.get(name)
+        if topic is None:
+            return
+        callbacks = topic.callbacks
+        for i in range(len(callbacks)):
+            if callbacks[i] == callback:
+                callbacks[i] = None
+
+    def wait(self, name):
+        # Parks the current task until the next delivery on the topic and
+        # returns its payload. Use with await/yield from.
+        topic = self.topic(name)
+        waiters = topic.waiters
+        for i in range(len(waiters)):
+            if waiters[i] is None:
+                waiters[i] = self._loop.cur_task
+                break
+        else:
+            raise ValueError("Too many waiters for {}".format(name))
+
+        yield False
+        return topic.payload
+
+    def _deliver(self, topic):
+        payload = topic.payload
+
+        callbacks = topic.callbacks
+        for i in range(len(callbacks)):
+            callback = callbacks[i]
+            if callback is None:
+                continue
+            topic.delivered += 1
             try:
-                callback(event, payload)
-            except:
-                print("EVENTBUS: Error calling callback {!r} for event {} and payload {!r}".format(callback, event, payload))
+                callback(topic.name, payload)
+            except Exception as exc:
+                topic.errors += 1
+                print("EVENTBUS: Error calling callback {!r} for event {}".format(callback, topic.name))
+                sys.print_exception(exc)
+
+        waiters = topic.waiters
+        for i in range(len(waiters)):
+            task = waiters[i]
+            if task is None:
+                continue
+            waiters[i] = None
+            topic.delivered += 1
+            self._loop.call_soon(task)
+
+    def _dispatch(self):
+        while True:
+            while self._pending:
+                self._pending = False
+                for topic in self._coalescing:
+                    if topic.pending:
+                        topic.pending = False
+                        self._deliver(topic)
+
+            # parked until the next pub() on a coalescing topic
+            self._parked = True
+            yield False
 
-    def sub(event, callback):
-        callbacks = EventBus.subscriptions.get(event, list())
-        callbacks.append(callback)
-        EventBus.subscriptions[event] = callbacks
+    def dump(self):
+        for name, topic in sorted(self._topics.items()):
+            print("EVENTBUS: {} published={} delivered={} coalesced={} errors={}".format(
+                name, topic.published, topic.delivered, topic.coalesced, topic.errors))
 
-    def unsub(event, callback):
-        EventBus.subscriptions[event] = [x for x in EventBus.subscriptions.get(event, List()) if x is not callback]
+_event_bus = None
+def get_event_bus():
+    global _event_bus
+    if _event_bus is None:
+        _event_bus = EventBus()
+    return _event_bus
@@ -0,0 +1,81 @@
+# Innermost pixel loops of the display and the light show. These are the
+# plain Python versions, kernels_viper has the same functions compiled to
+# machine code with the viper emitter, which is used if it imports. It
+# doesn't on the host or on ports built without the native emitters.
+# bench/parity.py checks both against the original code.
+#
+# The viper versions can't take more than four arguments and do integer
+# math in machine words, hence the parameter array for glyph() and the
+# limit on the heat values for diffuse().
+
+# glyph() params, array("H")
+GLYPH_HEIGHT = 0
+GLYPH_HEIGHT_BYTES = 1
+GLYPH_COLOR = 2
+GLYPH_BACKGROUND = 3
+
+# diffuse() is exact up to this heat. The viper version divides the sum of
+# three heat values by 3 as x * 43691 >> 17 in a 32 bit signed int, which
+# overflows for x >= 49152.
+HEAT_MAX = 4095
+assert HEAT_MAX * 3 < 49152
+
+def glyph(buf, letters, offset, params):
+    # Expands the X-GLCD letter at letters[offset] into RGB565 pixels in
+    # buf, column by column, and returns its width. Every pixel is written,
+    # so buf can be reused.
+    height = params[GLYPH_HEIGHT]
+    height_bytes = params[GLYPH_HEIGHT_BYTES]
+    color = params[GLYPH_COLOR]
+    background = params[GLYPH_BACKGROUND]
+    msb = color >> 8
+    lsb = color & 0xFF
+    bg_msb = background >> 8
+    bg_lsb = background & 0xFF
+
+    width = letters[offset]
+    offset += 1
+    pos = 0
+    for column in range(width):
+        lh = height
+        for i in range(height_bytes):
+            b = letters[offset]
+            offset += 1
+            bits = 8 if lh > 8 else lh
+            lh -= bits
+            for bit in range(bits):
+                if b & 1:
+                    buf[pos] = msb
+                    buf[pos + 1] = lsb
+                else:
+                    buf[pos] = bg_msb
+                    buf[pos + 1] = bg_lsb
+                b >>= 1
+                pos += 2
+    return width
+
+def fill(buf, color, count):
+    # first count RGB565 pixels of buf in color
+    msb = color >> 8
+    lsb = color & 0xFF
+    for i in range(0, count * 2, 2):
+        buf[i] = msb
+        buf[i + 1] = lsb
+
+def scale(out, color, level):
+    # out = color * level / 256, per channel of an RGB bytearray
+    out[0] = color[0] * level >> 8
+    out[1] = color[1] * level >> 8
+    out[2] = color[2] * level >> 8
+
+def diffuse(heat, count):
+    # heat drifts up the strip and diffuses a little, heat is an array("H")
+    for i in range(count - 1, 1, -1):
+        heat[i] = (heat[i - 1] + heat[i - 2] + heat[i - 2]) // 3
+
+NATIVE = False
+try:
+    from kernels_viper import glyph, fill, scale, diffuse
+    NATIVE = True
+except (ImportError, SyntaxError):
+    pass
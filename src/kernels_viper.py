@@ -0,0 +1,79 @@
+# Viper versions of the kernels, see kernels.py. Imported by it, don't use
+# directly.
+import sys
+
+import micropython
+
+if sys.implementation.name != "micropython":
+    # the host only has the decorators as stand-ins
+    raise ImportError("viper needs MicroPython")
+
+@micropython.viper
+def glyph(buf, letters, offset: int, params) -> int:
+    dst = ptr8(buf)
+    src = ptr8(letters)
+    p = ptr16(params)
+    height = p[0]
+    height_bytes = p[1]
+    msb = p[2] >> 8
+    lsb = p[2] & 0xFF
+    bg_msb = p[3] >> 8
+    bg_lsb = p[3] & 0xFF
+
+    width = src[offset]
+    offset += 1
+    pos = 0
+    column = 0
+    while column < width:
+        lh = height
+        i = 0
+        while i < height_bytes:
+            b = src[offset]
+            offset += 1
+            bits = 8
+            if lh < 8:
+                bits = lh
+            lh -= bits
+            while bits > 0:
+                if b & 1:
+                    dst[pos] = msb
+                    dst[pos + 1] = lsb
+                else:
+                    dst[pos] = bg_msb
+                    dst[pos + 1] = bg_lsb
+                b >>= 1
+                pos += 2
+                bits -= 1
+            i += 1
+        column += 1
+    return width
+
+@micropython.viper
+def fill(buf, color: int, count: int):
+    dst = ptr8(buf)
+    msb = color >> 8
+    lsb = color & 0xFF
+    i = 0
+    end = count * 2
+    while i < end:
+        dst[i] = msb
+        dst[i + 1] = lsb
+        i += 2
+
+@micropython.viper
+def scale(out, color, level: int):
+    dst = ptr8(out)
+    src = ptr8(color)
+    dst[0] = (src[0] * level) >> 8
+    dst[1] = (src[1] * level) >> 8
+    dst[2] = (src[2] * level) >> 8
+
+@micropython.viper
+def diffuse(heat, count: int):
+    h = ptr16(heat)
+    i = count - 1
+    while i > 1:
+        # x // 3 as a multiply and shift, exact as long as x * 43691 fits
+        # the signed 32 bit int, x < 49152, see HEAT_MAX in kernels.py
+        h[i] = ((h[i - 1] + h[i - 2] + h[i - 2]) * 43691) >> 17
+        i -= 1
@@ -0,0 +1,126 @@
+import array
+import time
+
+# Stages of a wheel revolution on its way to the OLED. Every stage records
+# the latency since the reed switch IRQ.
+IRQ = 0
+SPEED = 1   # Speedometer.update computed the new speed
+SCREEN = 2  # the speed screen started drawing it
+FLUSH = 3   # the last byte of it went out over SPI
+STAGES = ("irq", "speed", "screen", "flush")
+
+# upper bucket bounds in us, the last bucket takes everything slower
+BUCKETS = (500, 1000, 2000, 5000, 10000, 20000, 50000, 100000,
+           200000, 500000, 1000000, 2000000)
+
+# the sum behind the average is halved along with its count beyond this, so
+# it stays a small int (30 bits on the ESP32) on long rides
+SUM_LIMIT = 1 << 28
+
+class Histogram(object):
+    def __init__(self):
+        self._counts = array.array("I", [0] * (len(BUCKETS) + 1))
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self._sum = 0
+        self._n = 0
+        self.min = 0
+        self.max = 0
+        for i in range(len(self._counts)):
+            self._counts[i] = 0
+
+    def record(self, us):
+        if not self.count or us < self.min:
+            self.min = us
+        if us > self.max:
+            self.max = us
+        self.count += 1
+        self._sum += us
+        self._n += 1
+        if self._sum > SUM_LIMIT and self._n > 1:
+            self._sum >>= 1
+            self._n >>= 1
+
+        i = 0
+        while i < len(BUCKETS) and us > BUCKETS[i]:
+            i += 1
+        self._counts[i] += 1
+
+    @property
+    def avg(self):
+        # of all samples until SUM_LIMIT is reached, weighted towards the
+        # recent ones after
+        return self._sum // self._n if self._n else 0
+
+    def percentile(self, p):
+        # upper bound of the bucket holding the p-th percentile, in us
+        if not self.count:
+            return 0
+        rank = max(1, self.count * p // 100)
+        seen = 0
+        for i in range(len(BUCKETS)):
+            seen += self._counts[i]
+            if seen >= rank:
+                return min(BUCKETS[i], self.max)
+        return self.max
+
+class LatencyTrace(object):
+    # Follows one revolution at a time from the reed IRQ to the pixels: the
+    # first one after the previous trace finished, so the one that waited
+    # longest for its speed to show up. Stamps only move forward one stage
+    # at a time, a trace that stalls (speed screen not shown, speed
+    # unchanged) is abandoned at the next speed computation.
+    def __init__(self):
+        self.histograms = [Histogram() for _ in STAGES]
+        self.abandoned = 0
+        self._stage = None
+        self._start = 0
+
+    def reset(self):
+        for histogram in self.histograms:
+            histogram.reset()
+        self.abandoned = 0
+        self._stage = None
+
+    def start(self):
+        # from the IRQ handler, allocation free
+        if self._stage is None:
+            self._start = time.ticks_us()
+            self._stage = IRQ
+
+    def mark(self, stage):
+        if self._stage is None:
+            return
+        if stage != self._stage + 1:
+            if stage == SPEED:
+                # the previous speed never made it to the screen
+                self.abandoned += 1
+                self._stage = None
+            return
+
+        self.histograms[stage].record(time.ticks_diff(time.ticks_us(), self._start))
+        if stage == FLUSH:
+            self._stage = None
+        else:
+            self._stage = stage
+
+    def stats(self, stage):
+        # (count, min, avg, p95, max) in us
+        histogram = self.histograms[stage]
+        return (histogram.count, histogram.min, histogram.avg,
+                histogram.percentile(95), histogram.max)
+
+    def dump(self):
+        for stage in range(SPEED, len(STAGES)):
+            print("LATENCY: irq->{} n={} min={}us avg={}us p95={}us max={}us".format(
+                STAGES[stage], *self.stats(stage)))
+        print("LATENCY: {} traces abandoned".format(self.abandoned))
+
+_trace = None
+def get_trace():
+    global _trace
+    if _trace is None:
+        _trace = LatencyTrace()
+    return _trace
@@ -62,6 +62,7 @@ class Rotary(object):
         self._range_mode = range_mode
         self._value = min_val
         self._state = _R_START
+        self._listener = None
         
     def value(self):
         return self._value
@@ -71,6 +72,11 @@ class Rotary(object):
         
     def close(self):
         self._hal_close()
+
+    def set_listener(self, listener):
+        # called from the IRQ handler with the increment whenever the value
+        # changed
+        self._listener = listener
         
     def _process_rotary_pins(self, pin):
         clk_dt_pins = (self._hal_get_clk_value() << 1) | self._hal_get_dt_value()
@@ -92,3 +98,6 @@ class Rotary(object):
             self._value = _bound(self._value, incr, self._min_val, self._max_val)
         else:
             self._value = self._value + incr
+
+        if incr and self._listener is not None:
+            self._listener(incr)
@@ -1,6 +1,7 @@
 import uerrno
 import uselect as select
 import usocket as _socket
+import utime as time
 from uasyncio.core import *
 
 
@@ -66,7 +67,22 @@ class PollEventLoop(EventLoop):
         if DEBUG and __debug__:
             log.debug("poll.wait(%d)", delay)
         # We need one-shot behavior (second arg of 1 to .poll())
-        res = self.poller.ipoll(delay, 1)
+        if not self.flags:
+            # nothing but IO or a due task can wake the loop
+            res = self.poller.ipoll(0 if self._wakeup else delay, 1)
+        else:
+            # Poll in slices so that a Flag set from a soft IRQ gets the
+            # loop going again within WAKE_SLICE_MS
+            end = time.ticks_add(time.ticks_ms(), delay)
+            while True:
+                res = self.poller.ipoll(WAKE_SLICE_MS if delay < 0 else min(delay, WAKE_SLICE_MS), 1)
+                if res or self._flagged():
+                    break
+                if delay >= 0:
+                    delay = time.ticks_diff(end, time.ticks_ms())
+                    if delay <= 0:
+                        break
+        self._wakeup = False
         #log.debug("poll result: %s", res)
         # Remove "if res" workaround after
         # https://github.com/micropython/micropython/issues/2716 fixed.
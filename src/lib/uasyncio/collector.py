@@ -0,0 +1,116 @@
+import gc
+import utime as time
+
+from uasyncio import core
+
+
+class IdleCollector:
+    # EventLoop.idle hook that runs gc.collect() while the loop has nothing
+    # to do, so collections don't hit in the middle of an LED frame or an
+    # SPI transfer. Right after a frame went out the LED task sleeps until
+    # the next one and the display task waits for a redraw, those gaps are
+    # where it collects: once at least collect_after bytes were allocated
+    # since the last collection (or anything at all with less than
+    # low_water bytes free) and the gap is longer than budget_ms and twice
+    # the average collection.
+    #
+    # Looking at the heap isn't free either: gc.mem_alloc() walks the whole
+    # allocation table. It is read at most every check_ms, the time it
+    # took is in stats() and dump(), to be read off the board.
+    #
+    # gc.threshold() is set as a backstop, the collections MicroPython
+    # still runs on its own are counted as forced (those it notices, a
+    # heap that filled up again in between hides one).
+    #
+    # Usage:
+    #   collector = IdleCollector().install()
+    #   ...
+    #   collector.dump()
+
+    def __init__(self, collect_after=8192, threshold=24576, low_water=16384, budget_ms=10,
+                 check_ms=100):
+        self.collect_after = collect_after
+        self.threshold = threshold
+        self.low_water = low_water
+        self.budget_ms = budget_ms
+        self.check_ms = check_ms
+
+        # idle collections, their total and longest duration (us) and
+        # collections that happened elsewhere
+        self.collections = 0
+        self.total_us = 0
+        self.max_us = 0
+        self.forced = 0
+        # heap checks and their total and longest duration (us)
+        self.checks = 0
+        self.check_us = 0
+        self.max_check_us = 0
+
+        self._next = None
+        self._first = None
+        self._last = None
+        self._alloc = gc.mem_alloc()
+        self._checked = time.ticks_ms()
+
+    def install(self, loop=None):
+        loop = loop or core.get_event_loop()
+        self._next = loop.idle
+        loop.idle = self
+        gc.threshold(self.threshold)
+        return self
+
+    def idle(self, delay):
+        # a collection has to fit into the gap with room to spare
+        average = self.total_us // self.collections if self.collections else 0
+        if ((delay < 0 or delay * 1000 > max(self.budget_ms * 1000, average * 2))
+                and time.ticks_diff(time.ticks_ms(), self._checked) >= self.check_ms):
+            start = time.ticks_us()
+            alloc = gc.mem_alloc()
+            elapsed = time.ticks_diff(time.ticks_us(), start)
+            self._checked = time.ticks_ms()
+            self.checks += 1
+            self.check_us += elapsed
+            if elapsed > self.max_check_us:
+                self.max_check_us = elapsed
+
+            if alloc < self._alloc:
+                # MicroPython collected since we last looked
+                self.forced += 1
+                self._alloc = alloc
+
+            allocated = alloc - self._alloc
+            if allocated >= self.collect_after or allocated and gc.mem_free() < self.low_water:
+                self.collect()
+                return True
+
+        if self._next is not None:
+            return self._next.idle(delay)
+        return False
+
+    def collect(self):
+        start = time.ticks_us()
+        gc.collect()
+        elapsed = time.ticks_diff(time.ticks_us(), start)
+        self._alloc = gc.mem_alloc()
+
+        self.collections += 1
+        self.total_us += elapsed
+        if elapsed > self.max_us:
+            self.max_us = elapsed
+        self._last = time.ticks_ms()
+        if self._first is None:
+            self._first = self._last
+
+    def stats(self):
+        # (idle collections, avg us, max us, avg interval ms, forced,
+        #  heap checks, avg check us, max check us)
+        interval = 0
+        if self.collections > 1:
+            interval = time.ticks_diff(self._last, self._first) // (self.collections - 1)
+        return (self.collections, self.total_us // self.collections if self.collections else 0,
+                self.max_us, interval, self.forced,
+                self.checks, self.check_us // self.checks if self.checks else 0, self.max_check_us)
+
+    def dump(self):
+        print("COLLECTOR: {} idle collections avg={}us max={}us every {}ms, {} forced, "
+              "{} heap checks avg={}us max={}us".format(*self.stats()))
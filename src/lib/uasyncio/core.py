@@ -5,6 +5,14 @@ import ucollections
 
 type_gen = type((lambda: (yield))())
 
+# Task priority classes. Ready high priority tasks always run before
+# ready normal ones.
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 1
+
+# Longest stretch wait() sleeps without checking for a wakeup request
+WAKE_SLICE_MS = 5
+
 DEBUG = 0
 log = None
 
@@ -27,27 +35,124 @@ class TimeoutError(CancelledError):
 class EventLoop:
 
     def __init__(self, runq_len=16, waitq_len=16):
+        self.runq_len = runq_len
+        self.waitq_len = waitq_len
         self.runq = ucollections.deque((), runq_len, True)
+        # Ready high priority tasks (coroutines only, no callbacks)
+        self.runq_high = ucollections.deque((), runq_len, True)
+        self.high_tasks = set()
         self.waitq = utimeq.utimeq(waitq_len)
+        # Queue telemetry: high-water marks and how often a queue had to
+        # be grown because it was full
+        self.runq_hwm = 0
+        self.waitq_hwm = 0
+        self.runq_overflows = 0
+        self.waitq_overflows = 0
         # Current task being run. Task is a top-level coroutine scheduled
         # in the event loop (sub-coroutines executed transparently by
         # yield from/await, event loop "doesn't see" them).
         self.cur_task = None
+        # Set by wake() (e.g. from a micropython.schedule() callback) to
+        # cut the current wait() short
+        self._wakeup = False
+        # Flags with a parked waiter, see synchro.Flag. While there are
+        # any wait() sleeps in slices and polls them in between.
+        self.flags = []
+        # Optional instrumentation hook, see uasyncio.profiler. Gets
+        # .wake(task, time) when a task's (or callback's) wait time is
+        # over, .start(task) / .stop(task) around every slice a task runs
+        # and .done(task) after the last one, when it finished or got
+        # cancelled.
+        self.monitor = None
+        # Optional idle hook, see uasyncio.collector. Gets
+        # .idle(delay) before the loop waits with nothing to run, delay is
+        # the time in ms until the next task is due (-1 = none). If it
+        # returns True it did some work and the loop looks around again.
+        self.idle = None
+
+    def wake(self):
+        self._wakeup = True
+
+    def _flagged(self):
+        # Resumes the waiters of parked Flags that got set without it (by
+        # Flag.isr() with the schedule queue full), True if the loop has
+        # something to run again. A soft IRQ resuming a Flag meanwhile
+        # at worst makes this skip one, the next slice gets it.
+        for flag in self.flags:
+            if flag.state:
+                flag._resume()
+        return self._wakeup
 
     def time(self):
         return time.ticks_ms()
 
-    def create_task(self, coro):
+    def create_task(self, coro, priority=PRIORITY_NORMAL):
         # CPython 3.4.2
+        self.set_priority(coro, priority)
         self.call_later_ms(0, coro)
         # CPython asyncio incompatibility: we don't return Task object
 
+    def set_priority(self, coro, priority):
+        if priority == PRIORITY_HIGH:
+            self.high_tasks.add(coro)
+        else:
+            self.high_tasks.discard(coro)
+
     def call_soon(self, callback, *args):
         if __debug__ and DEBUG:
             log.debug("Scheduling in runq: %s", (callback, args))
-        self.runq.append(callback)
-        if not isinstance(callback, type_gen):
-            self.runq.append(args)
+        if self.high_tasks and callback in self.high_tasks:
+            runq = self.runq_high
+            if len(runq) >= self.runq_len:
+                self._grow_runq()
+                runq = self.runq_high
+            runq.append(callback)
+        else:
+            # callbacks take a second entry for their args
+            gen = isinstance(callback, type_gen)
+            runq = self.runq
+            if len(runq) + (not gen) >= self.runq_len:
+                self._grow_runq()
+                runq = self.runq
+            runq.append(callback)
+            if not gen:
+                runq.append(args)
+        if len(runq) > self.runq_hwm:
+            self.runq_hwm = len(runq)
+
+    def _grow_runq(self):
+        self.runq_overflows += 1
+        self.runq_len *= 2
+        print("UASYNCIO: runq full, growing to %d entries, raise RUNQ_LEN" % self.runq_len)
+        for name in ("runq", "runq_high"):
+            old = getattr(self, name)
+            new = ucollections.deque((), self.runq_len, True)
+            while old:
+                new.append(old.popleft())
+            setattr(self, name, new)
+
+    def _grow_waitq(self):
+        self.waitq_overflows += 1
+        self.waitq_len *= 2
+        print("UASYNCIO: waitq full, growing to %d entries, raise WAITQ_LEN" % self.waitq_len)
+        old = self.waitq
+        new = utimeq.utimeq(self.waitq_len)
+        entry = [0, 0, 0]
+        while old:
+            old.pop(entry)
+            new.push(entry[0], entry[1], entry[2])
+        self.waitq = new
+
+    def queue_stats(self):
+        # (runq capacity, runq high-water mark, runq overflows,
+        #  waitq capacity, waitq high-water mark, waitq overflows)
+        return (self.runq_len, self.runq_hwm, self.runq_overflows,
+                self.waitq_len, self.waitq_hwm, self.waitq_overflows)
+
+    def dump_queues(self):
+        print("UASYNCIO: runq %d/%d max, %d overflows; waitq %d/%d max, %d overflows" % (
+            self.runq_hwm, self.runq_len, self.runq_overflows,
+            self.waitq_hwm, self.waitq_len, self.waitq_overflows))
 
     def call_later(self, delay, callback, *args):
         self.call_at_(time.ticks_add(self.time(), int(delay * 1000)), callback, args)
@@ -60,37 +165,85 @@ class EventLoop:
     def call_at_(self, time, callback, args=()):
         if __debug__ and DEBUG:
             log.debug("Scheduling in waitq: %s", (time, callback, args))
-        self.waitq.push(time, callback, args)
+        try:
+            self.waitq.push(time, callback, args)
+        except IndexError:
+            self._grow_waitq()
+            self.waitq.push(time, callback, args)
+        if len(self.waitq) > self.waitq_hwm:
+            self.waitq_hwm = len(self.waitq)
 
     def wait(self, delay):
         # Default wait implementation, to be overriden in subclasses
         # with IO scheduling
         if __debug__ and DEBUG:
             log.debug("Sleeping for: %s", delay)
-        time.sleep_ms(delay)
+        if delay >= 0 and not self.flags:
+            # nothing but a due task can wake the loop
+            if not self._wakeup:
+                time.sleep_ms(delay)
+        else:
+            # a soft IRQ may set a parked Flag any time, look at them
+            # every WAKE_SLICE_MS
+            end = time.ticks_add(time.ticks_ms(), delay)
+            while not self._flagged():
+                if delay >= 0:
+                    delay = time.ticks_diff(end, time.ticks_ms())
+                    if delay <= 0:
+                        break
+                    time.sleep_ms(min(delay, WAKE_SLICE_MS))
+                else:
+                    time.sleep_ms(WAKE_SLICE_MS)
+        self._wakeup = False
+
+    def expire(self, cur_task):
+        # Move entries in waitq which are due to runq
+        tnow = self.time()
+        while self.waitq:
+            t = self.waitq.peektime()
+            delay = time.ticks_diff(t, tnow)
+            if delay > 0:
+                break
+            self.waitq.pop(cur_task)
+            if __debug__ and DEBUG:
+                log.debug("Moving from waitq to runq: %s", cur_task[1])
+            if self.monitor is not None:
+                self.monitor.wake(cur_task[1], t)
+            self.call_soon(cur_task[1], *cur_task[2])
 
     def run_forever(self):
         cur_task = [0, 0, 0]
         while True:
-            # Expire entries in waitq and move them to runq
-            tnow = self.time()
-            while self.waitq:
-                t = self.waitq.peektime()
-                delay = time.ticks_diff(t, tnow)
-                if delay > 0:
-                    break
-                self.waitq.pop(cur_task)
-                if __debug__ and DEBUG:
-                    log.debug("Moving from waitq to runq: %s", cur_task[1])
-                self.call_soon(cur_task[1], *cur_task[2])
-
-            # Process runq
+            self.expire(cur_task)
+
+            # Process runq, high priority tasks first. Only entries present
+            # at the start of the pass are run, to get back to wait()
+            # eventually. High priority tasks coming due from waitq during
+            # the pass run before the next normal task, ones that
+            # rescheduled themselves wait for the next pass like everyone.
+            h = len(self.runq_high)
             l = len(self.runq)
+            # earliest waitq entry while there are high priority tasks, so
+            # the clock is only read when something may be due
+            due = None
+            if self.high_tasks and self.waitq:
+                due = self.waitq.peektime()
             if __debug__ and DEBUG:
-                log.debug("Entries in runq: %d", l)
-            while l:
-                cb = self.runq.popleft()
-                l -= 1
+                log.debug("Entries in runq: %d high, %d normal", h, l)
+            while True:
+                if not h and l and due is not None and time.ticks_diff(due, time.ticks_ms()) <= 0:
+                    h = len(self.runq_high)
+                    self.expire(cur_task)
+                    h = len(self.runq_high) - h
+                    due = self.waitq.peektime() if self.waitq else None
+                if h:
+                    cb = self.runq_high.popleft()
+                    h -= 1
+                elif l:
+                    cb = self.runq.popleft()
+                    l -= 1
+                else:
+                    break
                 args = ()
                 if not isinstance(cb, type_gen):
                     args = self.runq.popleft()
@@ -104,11 +257,16 @@ class EventLoop:
                     log.info("Next coroutine to run: %s", (cb, args))
                 self.cur_task = cb
                 delay = 0
+                monitor = self.monitor
+                if monitor is not None:
+                    monitor.start(cb)
                 try:
-                    if args is ():
+                    if not args:
                         ret = next(cb)
                     else:
                         ret = cb.send(*args)
+                    if monitor is not None:
+                        monitor.stop(cb)
                     if __debug__ and DEBUG:
                         log.info("Coroutine %s yield result: %s", cb, ret)
                     if isinstance(ret, SysCall1):
@@ -133,22 +291,31 @@ class EventLoop:
                             assert False, "Unknown syscall yielded: %r (of type %r)" % (ret, type(ret))
                     elif isinstance(ret, type_gen):
                         self.call_soon(ret)
-                    elif isinstance(ret, int):
-                        # Delay
-                        delay = ret
                     elif ret is None:
                         # Just reschedule
                         pass
                     elif ret is False:
-                        # Don't reschedule
+                        # Don't reschedule (before the int check, bool is
+                        # an int on CPython, which the simulator runs on)
                         continue
+                    elif isinstance(ret, int):
+                        # Delay
+                        delay = ret
                     else:
                         assert False, "Unsupported coroutine yield value: %r (of type %r)" % (ret, type(ret))
                 except StopIteration as e:
+                    if monitor is not None:
+                        monitor.stop(cb)
+                        monitor.done(cb)
+                    if self.high_tasks:
+                        self.high_tasks.discard(cb)
                     if __debug__ and DEBUG:
                         log.debug("Coroutine finished: %s", cb)
                     continue
                 except CancelledError as e:
+                    if monitor is not None:
+                        monitor.stop(cb)
+                        monitor.done(cb)
                     if __debug__ and DEBUG:
                         log.debug("Coroutine cancelled: %s", cb)
                     continue
@@ -157,12 +324,14 @@ class EventLoop:
                 # If that changes, need to pass that value below.
                 if delay:
                     self.call_later_ms(delay, cb)
+                    if self.high_tasks:
+                        due = self.waitq.peektime()
                 else:
                     self.call_soon(cb)
 
             # Wait until next waitq task or I/O availability
             delay = 0
-            if not self.runq:
+            if not self.runq and not self.runq_high and not self._wakeup:
                 delay = -1
                 if self.waitq:
                     tnow = self.time()
@@ -170,6 +339,8 @@ class EventLoop:
                     delay = time.ticks_diff(t, tnow)
                     if delay < 0:
                         delay = 0
+                if delay and self.idle is not None and self.idle.idle(delay):
+                    continue
             self.wait(delay)
 
     def run_until_complete(self, coro):
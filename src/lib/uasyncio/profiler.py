@@ -0,0 +1,85 @@
+import utime as time
+
+from uasyncio import core
+
+
+class TaskProfiler:
+    # Per task accounting for EventLoop.monitor: number of slices, total
+    # and longest slice run time (us) and scheduling lateness, i.e. how
+    # much later than requested a sleeping task actually got to run (ms).
+    # Only tasks are recorded, not callbacks, and only while they exist:
+    # the entry of a finished task is dropped.
+    #
+    # Usage:
+    #   profiler = TaskProfiler().install()
+    #   ...
+    #   profiler.dump()
+
+    def __init__(self):
+        self.tasks = {}
+        self.max_lateness = 0
+        self._started = 0
+
+    def install(self, loop=None):
+        (loop or core.get_event_loop()).monitor = self
+        return self
+
+    def uninstall(self, loop=None):
+        loop = loop or core.get_event_loop()
+        if loop.monitor is self:
+            loop.monitor = None
+
+    def reset(self):
+        self.tasks = {}
+        self.max_lateness = 0
+
+    def _entry(self, task):
+        entry = self.tasks.get(task)
+        if entry is None:
+            # name, slices, total us, max us, total lateness ms,
+            # max lateness ms, wake time requested
+            entry = [repr(task), 0, 0, 0, 0, 0, None]
+            self.tasks[task] = entry
+        return entry
+
+    def wake(self, task, t):
+        if type(task) is core.type_gen:
+            self._entry(task)[6] = t
+
+    def start(self, task):
+        entry = self._entry(task)
+        if entry[6] is not None:
+            lateness = time.ticks_diff(time.ticks_ms(), entry[6])
+            entry[6] = None
+            entry[4] += lateness
+            if lateness > entry[5]:
+                entry[5] = lateness
+            if lateness > self.max_lateness:
+                self.max_lateness = lateness
+        self._started = time.ticks_us()
+
+    def stop(self, task):
+        elapsed = time.ticks_diff(time.ticks_us(), self._started)
+        entry = self.tasks[task]
+        entry[1] += 1
+        entry[2] += elapsed
+        if elapsed > entry[3]:
+            entry[3] = elapsed
+
+    def done(self, task):
+        self.tasks.pop(task, None)
+
+    def stats(self):
+        # [(name, slices, total us, max us, avg lateness ms, max lateness ms)],
+        # busiest task first
+        result = []
+        for name, slices, total, longest, late, max_late, _ in self.tasks.values():
+            result.append((name, slices, total, longest, late // slices if slices else 0, max_late))
+        result.sort(key=lambda x: x[2], reverse=True)
+        return result
+
+    def dump(self):
+        print("PROFILER: max lateness {}ms".format(self.max_lateness))
+        for name, slices, total, longest, late, max_late in self.stats():
+            print("PROFILER: {} slices={} total={}us max={}us late avg={}ms max={}ms".format(
+                name, slices, total, longest, late, max_late))
@@ -1,5 +1,5 @@
 from collections.deque import deque
-from uasyncio.core import sleep
+from uasyncio import core
 
 
 class QueueEmpty(Exception):
@@ -20,12 +20,38 @@ class Queue:
     Unlike the standard library Queue, you can reliably know this Queue's size
     with qsize(), since your single-threaded uasyncio application won't be
     interrupted between calling qsize() and doing an operation on the Queue.
+
+    Blocked getters and putters are parked on waiting lists (like
+    synchro.Lock does) and rescheduled one at a time by the opposite
+    operation, instead of polling the queue.
     """
-    _attempt_delay = 0.1
 
     def __init__(self, maxsize=0):
         self.maxsize = maxsize
         self._queue = deque()
+        self._getters = []
+        self._putters = []
+
+    def _wake(self, waiters):
+        if waiters:
+            core.get_event_loop().call_soon(waiters.pop(0))
+
+    def _park(self, waiters):
+        # Waits on waiters until the opposite operation wakes the task.
+        # A task cancelled (or timed out by wait_for) while parked has to
+        # leave the list, and one cancelled after it got woken passes the
+        # wakeup on to the next waiter.
+        task = core.get_event_loop().cur_task
+        waiters.append(task)
+        try:
+            yield False
+        except BaseException:
+            if task not in waiters:
+                self._wake(waiters)
+            raise
+        finally:
+            if task in waiters:
+                waiters.remove(task)
 
     def _get(self):
         return self._queue.popleft()
@@ -38,18 +64,22 @@ class Queue:
 
             item = yield from queue.get()
         """
-        while not self._queue:
-            yield from sleep(self._attempt_delay)
-        return self._get()
+        while not self.qsize():
+            yield from self._park(self._getters)
+        val = self._get()
+        self._wake(self._putters)
+        return val
 
     def get_nowait(self):
         """Remove and return an item from the queue.
 
         Return an item if one is immediately available, else raise QueueEmpty.
         """
-        if not self._queue:
+        if not self.qsize():
             raise QueueEmpty()
-        return self._get()
+        val = self._get()
+        self._wake(self._putters)
+        return val
 
     def _put(self, val):
         self._queue.append(val)
@@ -62,8 +92,9 @@ class Queue:
             yield from queue.put(item)
         """
         while self.qsize() >= self.maxsize and self.maxsize:
-            yield from sleep(self._attempt_delay)
+            yield from self._park(self._putters)
         self._put(val)
+        self._wake(self._getters)
 
     def put_nowait(self, val):
         """Put an item into the queue without blocking.
@@ -73,6 +104,7 @@ class Queue:
         if self.qsize() >= self.maxsize and self.maxsize:
             raise QueueFull()
         self._put(val)
+        self._wake(self._getters)
 
     def qsize(self):
         """Number of items in the queue."""
@@ -80,7 +112,7 @@ class Queue:
 
     def empty(self):
         """Return True if the queue is empty, False otherwise."""
-        return not self._queue
+        return not self.qsize()
 
     def full(self):
         """Return True if there are maxsize items in the queue.
@@ -92,3 +124,34 @@ class Queue:
             return False
         else:
             return self.qsize() >= self.maxsize
+
+
+class RingQueue(Queue):
+    """A bounded Queue backed by a preallocated ring buffer.
+
+    Putting and getting items does not allocate, which makes it suitable for
+    steady state producer/consumer pipelines. maxsize has to be greater
+    than 0.
+    """
+
+    def __init__(self, maxsize):
+        assert maxsize > 0
+        Queue.__init__(self, maxsize)
+        self._queue = [None] * maxsize
+        self._head = 0
+        self._size = 0
+
+    def _get(self):
+        val = self._queue[self._head]
+        self._queue[self._head] = None
+        self._head = (self._head + 1) % self.maxsize
+        self._size -= 1
+        return val
+
+    def _put(self, val):
+        self._queue[(self._head + self._size) % self.maxsize] = val
+        self._size += 1
+
+    def qsize(self):
+        """Number of items in the queue."""
+        return self._size
@@ -1,3 +1,6 @@
+import micropython
+import utime as time
+
 from uasyncio import core
 
 class Lock:
@@ -26,3 +29,75 @@ class Lock:
             #print("putting", core.get_event_loop().cur_task, "on waiting list")
             self.wlist.append(core.get_event_loop().cur_task)
             yield False
+
+
+class Flag:
+    # Wakes a single waiting task. set() may be called from tasks and from
+    # soft IRQ / micropython.schedule() context, isr() from hard IRQs only:
+    # soft IRQ handlers already run scheduled and call set() directly.
+
+    def __init__(self):
+        self.state = False
+        self.waiter = None
+        self._deadline = None
+        # preallocated bound methods, so neither IRQs nor timeouts allocate
+        self._set = self.set
+        self._expire = self.expire
+
+    def set(self, _=None):
+        self.state = True
+        self._resume()
+
+    def isr(self, _=None):
+        try:
+            micropython.schedule(self._set, None)
+        except RuntimeError:
+            # Schedule queue full. A hard IRQ mustn't touch the run queue,
+            # so only set the state: the loop polls parked Flags while it
+            # waits and resumes the waiter from there.
+            self.state = True
+
+    def clear(self):
+        self.state = False
+
+    def is_set(self):
+        return self.state
+
+    def expire(self):
+        # Timeout callback, stale ones (from a wait() that got set() before
+        # its timeout) are recognized by the deadline not being due yet
+        if self._deadline is not None and time.ticks_diff(time.ticks_ms(), self._deadline) >= 0:
+            self._resume()
+
+    def _resume(self):
+        self._deadline = None
+        if self.waiter is not None:
+            loop = core.get_event_loop()
+            loop.flags.remove(self)
+            loop.call_soon(self.waiter)
+            self.waiter = None
+            loop.wake()
+
+    def wait(self, timeout=-1):
+        # Usage: set = yield from flag.wait() / set = await flag.wait(timeout)
+        # Returns True if the flag got set, False on timeout.
+        if not self.state:
+            assert self.waiter is None, "Flag supports a single waiter"
+            loop = core.get_event_loop()
+            self.waiter = loop.cur_task
+            loop.flags.append(self)
+            if timeout >= 0:
+                self._deadline = time.ticks_add(time.ticks_ms(), timeout)
+                loop.call_later_ms(timeout, self._expire)
+            try:
+                yield False
+            finally:
+                # still parked if the waiter got cancelled
+                if self.waiter is not None:
+                    self.waiter = None
+                    self._deadline = None
+                    loop.flags.remove(self)
+            if not self.state:
+                return False
+        self.state = False
+        return True
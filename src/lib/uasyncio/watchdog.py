@@ -0,0 +1,92 @@
+import utime as time
+
+from uasyncio import core
+
+
+class LoopWatchdog:
+    # EventLoop.monitor that flags task slices running longer than
+    # budget_ms and keeps the last few offenders around. With a hardware
+    # watchdog timeout given it also feeds a machine.WDT from its own task,
+    # so the board resets if the loop stops making progress altogether.
+    #
+    # Chains to an already installed monitor (e.g. a TaskProfiler). With
+    # budget_ms=0 it only feeds the hardware watchdog and stays out of the
+    # loop's monitor hooks, which time every slice otherwise.
+    #
+    # Usage:
+    #   watchdog = LoopWatchdog(budget_ms=100, wdt_timeout_ms=5000).install()
+    #   ...
+    #   watchdog.dump()
+
+    def __init__(self, budget_ms=100, offenders=8, wdt_timeout_ms=0, verbose=True):
+        self.budget_us = budget_ms * 1000
+        self.verbose = verbose
+        self.overruns = 0
+
+        # ring of (task name, slice us, ticks_ms)
+        self.offenders = [None] * offenders
+        self._offender = 0
+
+        self._wdt_timeout = wdt_timeout_ms
+        self._wdt = None
+        self._next = None
+        self._started = 0
+
+    def install(self, loop=None):
+        loop = loop or core.get_event_loop()
+        if self.budget_us:
+            self._next = loop.monitor
+            loop.monitor = self
+        if self._wdt_timeout:
+            import machine
+            self._wdt = machine.WDT(timeout=self._wdt_timeout)
+            loop.create_task(self._feed())
+        return self
+
+    def _feed(self):
+        interval = self._wdt_timeout // 4
+        while True:
+            self._wdt.feed()
+            yield from core.sleep_ms(interval)
+
+    def wake(self, task, t):
+        if self._next is not None:
+            self._next.wake(task, t)
+
+    def start(self, task):
+        if self._next is not None:
+            self._next.start(task)
+        self._started = time.ticks_us()
+
+    def stop(self, task):
+        elapsed = time.ticks_diff(time.ticks_us(), self._started)
+        if self._next is not None:
+            self._next.stop(task)
+        if elapsed > self.budget_us:
+            self._overrun(task, elapsed)
+
+    def done(self, task):
+        if self._next is not None:
+            self._next.done(task)
+
+    def _overrun(self, task, elapsed):
+        self.overruns += 1
+        self.offenders[self._offender] = (repr(task), elapsed, time.ticks_ms())
+        self._offender = (self._offender + 1) % len(self.offenders)
+        if self.verbose:
+            print("WATCHDOG: {} ran {}us without yielding".format(repr(task), elapsed))
+
+    def recent(self):
+        # offenders, oldest first
+        count = len(self.offenders)
+        result = []
+        for i in range(count):
+            entry = self.offenders[(self._offender + i) % count]
+            if entry is not None:
+                result.append(entry)
+        return result
+
+    def dump(self):
+        print("WATCHDOG: {} slices over {}us".format(self.overruns, self.budget_us))
+        for name, elapsed, when in self.recent():
+            print("WATCHDOG: {} ran {}us at {}".format(name, elapsed, when))
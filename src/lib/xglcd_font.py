@@ -23,7 +23,8 @@ class XglcdFont(object):
     # Dict to tranlate bitwise values to byte position
     BIT_POS = {1: 0, 2: 2, 4: 4, 8: 6, 16: 8, 32: 10, 64: 12, 128: 14, 256: 16}
 
-    def __init__(self, path, width, height, start_letter=32, letter_count=96):
+    def __init__(self, path, width, height, start_letter=32, letter_count=96,
+                 letters=None):
         """Constructor for X-GLCD Font object.
 
         Args:
@@ -32,6 +33,8 @@ class XglcdFont(object):
             height (int): Height in pixels of each letter
             start_letter (int): First ACII letter.  Default is 32.
             letter_count (int): Total number of letters.  Default is 96.
+            letters (bytes): Letter byte values already loaded, e.g. frozen
+                into the firmware, used instead of parsing path.
         """
         self.width = width
         self.height = height
@@ -39,7 +42,10 @@ class XglcdFont(object):
         self.letter_count = letter_count
         self.bytes_per_letter = (floor(
             (self.height - 1) / 8) + 1) * self.width + 1
-        self.__load_xglcd_font(path)
+        if letters is not None:
+            self.letters = letters
+        else:
+            self.__load_xglcd_font(path)
 
     def __load_xglcd_font(self, path):
         """Load X-GLCD font data from text file.
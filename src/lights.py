@@ -1,9 +1,13 @@
 import machine
 import neopixel
+import array
 import random
 
 import uasyncio as asyncio
 
+import kernels
+import memstat
+
 
 PIXEL_PIN = machine.Pin(4)
 PIXEL_COUNT = 29
@@ -50,7 +54,7 @@ class LarsonScannerEffect(Effect):
         self._colors = [(self._color[0] * x // 256, self._color[1] * x // 256, self._color[2] * x // 256) for x in self.EYE]
 
     async def run(self, lights):
-        colors = [(self._color[0] * x // 256, self._color[1] * x // 256, self._color[2] * x // 256) for x in self.EYE]
+        colors = self._colors
         pixels = lights.count
 
         async def move(dir):
@@ -82,7 +86,7 @@ class RunningLightEffect(Effect):
         self._colors = [(self._color[0] * x // 256, self._color[1] * x // 256, self._color[2] * x // 256) for x in self.LIGHT]
 
     async def run(self, lights):
-        colors = [(self._color[0] * x // 256, self._color[1] * x // 256, self._color[2] * x // 256) for x in self.LIGHT]
+        colors = self._colors
         pixels = lights.count
 
         r = range(len(self.LIGHT) - 1, pixels)
@@ -107,6 +111,8 @@ class BreathingEffect(Effect):
     def __init__(self, color, steps):
         self._color = color
         self._steps = steps
+        self._rgb = bytearray(color)
+        self._scaled = bytearray(3)
 
     async def run(self, lights):
         pixels = lights.count
@@ -118,11 +124,8 @@ class BreathingEffect(Effect):
                 rng = reversed(rng)
 
             for i in rng:
-                r, g, b = self._color
-                r = int((i / 256) * r)
-                g = int((i / 256) * g)
-                b = int((i / 256) * b)
-                lights.set_all((r, g, b))
+                kernels.scale(self._scaled, self._rgb, i)
+                lights.set_all(self._scaled)
                 lights.apply()
                 await asyncio.sleep_ms(1)
 
@@ -194,7 +197,7 @@ class FireEffect(Effect):
 
     async def run(self, lights):
         if self._heat is None:
-            self._heat = [0] * lights.count
+            self._heat = array.array("H", [0] * lights.count)
         heat = self._heat
 
         def burn():
@@ -207,13 +210,12 @@ class FireEffect(Effect):
                     heat[i] = heat[i] - cooldown
 
             # heat from each cell drifts up and diffuses a little
-            for i in range(lights.count - 1, 1, -1):
-                heat[i] = (heat[i - 1] + heat[i - 2] + heat[i - 2]) // 3
+            kernels.diffuse(heat, lights.count)
 
             # randomly ignite new sparks near the bottom
             if random.randint(0, 255) < self._sparking:
                 spark = random.randint(0, 7)
-                heat[spark] = heat[spark] + random.randint(160, 255)
+                heat[spark] = min(heat[spark] + random.randint(160, 255), kernels.HEAT_MAX)
 
             # convert to led colors
             for i in range(lights.count):
@@ -238,7 +240,8 @@ class FireEffect(Effect):
 
 
 class LightShow(object):
-    def __init__(self):
+    def __init__(self, persistence=None):
+        self._persistence = persistence
         self._lights = ScooterLight(PIXEL_PIN, PIXEL_COUNT)
 
         self._effects = dict(larson=LarsonScannerEffect((255, 0, 0), 30),
@@ -258,7 +261,9 @@ class LightShow(object):
         self.load()
 
         loop = asyncio.get_event_loop()
-        loop.create_task(self.update())
+        task = self.update()
+        memstat.tag(task, memstat.LIGHTS)
+        loop.create_task(task, asyncio.PRIORITY_HIGH)
 
     @property
     def effect(self):
@@ -269,7 +274,10 @@ class LightShow(object):
         if not value in self._effects:
             raise ValueError()
         self._effect = value
-        self.save()
+        if self._persistence:
+            self._persistence.mark_dirty("effect", self.save)
+        else:
+            self.save()
         print("LIGHTSHOW: New effect = {}".format(self._effect))
 
     async def update(self):
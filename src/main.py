@@ -1,18 +1,66 @@
-import machine
-import neopixel
-
-import random
+import gc
 import time
 
 import uasyncio as asyncio
+from uasyncio.collector import IdleCollector
+from uasyncio.watchdog import LoopWatchdog
 
 import micropython
 micropython.alloc_emergency_exception_buf(100)
 
-import lights
-import speedometer
+# only what it takes to get the logo up, the rest is imported while booting
+import events
+import latency
+import memstat
+import persistence
 import display
 
+# event loop queue sizes, tasks + pending callbacks (two entries each) and
+# sleeping tasks. Both grow at runtime if they overflow, but that allocates
+# and gets reported
+RUNQ_LEN = 16
+WAITQ_LEN = 24
+
+# collect garbage while the loop is idle once this much was allocated, let
+# MicroPython collect on its own (wherever that happens) after GC_THRESHOLD
+GC_COLLECT_AFTER = 8192 # bytes
+GC_THRESHOLD = 24576 # bytes
+
+LOGO = "/36c3-logo.raw"
+try:
+    # frozen into the firmware by freeze/, drawn straight from flash
+    from image_36c3_logo import PIXELS as LOGO_PIXELS
+except ImportError:
+    LOGO_PIXELS = None
+
+# debugging aids
+PROFILE_TASKS = False
+PROFILE_INTERVAL = 60 # s
+# adds screens with reed to display latencies and heap usage per subsystem
+# to the rotation
+DIAGNOSTICS = False
+
+# with DIAGNOSTICS report task slices longer than this, reset the board if
+# the loop stalls for longer than WDT_TIMEOUT (0 = no hardware watchdog)
+SLICE_BUDGET = 100 # ms
+WDT_TIMEOUT = 0 # ms
+
+def draw_logo(screen, x=0, y=0):
+    if LOGO_PIXELS is None:
+        screen.draw_image(LOGO, x=x, y=y, w=127, h=127)
+    else:
+        screen.draw_sprite(LOGO_PIXELS, x, y, 127, 127)
+
+async def dump_profile(loop, profiler, collector):
+    while True:
+        await asyncio.sleep(PROFILE_INTERVAL)
+        profiler.dump()
+        loop.dump_queues()
+        collector.dump()
+        latency.get_trace().dump()
+        if DIAGNOSTICS:
+            memstat.get_monitor().dump()
+
 class LogoScreen(display.DisplayScreen):
     def __init__(self, light_show):
         display.DisplayScreen.__init__(self)
@@ -31,7 +79,7 @@ class LogoScreen(display.DisplayScreen):
         if self._off:
             screen.clear()
         else:
-            screen.draw_image("/36c3-logo.raw", x=self._x0, y=self._y0, w=127, h=127)
+            draw_logo(screen, self._x0, self._y0)
 
     def encoder_click(self):
         if self._off:
@@ -58,55 +106,190 @@ class SpeedometerScreen(display.DisplayScreen):
                            trip=False)
 
         self._reset_timer = None
+        self._trace = latency.get_trace()
 
-        self._speed = 0.0
-        self._distance = 0.0
-        self._top_speed = 0.0
-        self._trip = 0.0
+        # km/h * 100 and km * 100, as the speedometer scales them
+        self._speed = 0
+        self._distance = 0
+        self._top_speed = 0
+        self._trip = 0
+        # the values are formatted into this instead of new strings
+        self._text = bytearray(16)
 
     def update(self, screen, needs_full_redraw=False):
-        from ssd1351 import color565
-
         if needs_full_redraw:
-            screen.fill_rectangle(0, 0, 127, 9, color565(0, 0, 0))
-            screen.draw_text(self._x0, 0 + self._y0, "Speed (km/h)", display.FONT_FIXED, color565(255,255,255))
-            screen.fill_rectangle(0, 45, 127, 9, color565(0, 0, 0))
-            screen.draw_text(self._x0, 45 + self._y0, "Top Speed (km/h)", display.FONT_FIXED, color565(255, 255, 255))
-            screen.fill_rectangle(0, 63, 127, 9, color565(0, 0, 0))
-            screen.draw_text(self._x0, 63 + self._y0, "Distance (km)", display.FONT_FIXED, color565(255, 255, 255))
-            screen.fill_rectangle(0, 91, 127, 9, color565(0, 0, 0))
-            screen.draw_text(self._x0, 91 + self._y0, "Total Distance (km)", display.FONT_FIXED, color565(255, 255, 255))
-
-        if self._speed != self._speedometer.speed or needs_full_redraw:
-            self._speed = self._speedometer.speed
-            screen.fill_rectangle(0, 9, 127, 25, color565(0, 0, 0))
-            screen.draw_text(self._x0, 9 + self._y0, "{:.2f}".format(self._speed), display.FONT_UNISPACE, color565(0, 255, 0))
-
-        if self._top_speed != self._speedometer.top_speed or needs_full_redraw:
-            self._top_speed = self._speedometer.top_speed
-            screen.fill_rectangle(0, 54, 127, 9, color565(0, 0, 0))
-            screen.draw_text(self._x0, 54 + self._y0, "{:.2f}".format(self._top_speed), display.FONT_FIXED, color565(0, 255, 0))
-
-        if self._trip != self._speedometer.trip or needs_full_redraw:
-            self._trip = self._speedometer.trip
-            screen.fill_rectangle(0, 72, 127, 9, color565(0, 0, 0))
-            screen.draw_text(self._x0, 72 + self._y0, "{:.2f}".format(self._trip / 1000.0), display.FONT_FIXED, color565(0, 255, 0))
-
-        if self._distance != self._speedometer.distance or needs_full_redraw:
-            self._distance = self._speedometer.distance
-            screen.fill_rectangle(0, 100, 127, 9, color565(0, 0, 0))
-            screen.draw_text(self._x0, 100 + self._y0, "{:.2f}".format(self._distance / 1000.0), display.FONT_FIXED, color565(0, 255, 0))
+            screen.fill_rectangle(0, 0, 127, 9, display.BACKGROUND)
+            screen.draw_text(self._x0, 0 + self._y0, "Speed (km/h)", display.FONT_FIXED, display.LABEL)
+            screen.fill_rectangle(0, 45, 127, 9, display.BACKGROUND)
+            screen.draw_text(self._x0, 45 + self._y0, "Top Speed (km/h)", display.FONT_FIXED, display.LABEL)
+            screen.fill_rectangle(0, 63, 127, 9, display.BACKGROUND)
+            screen.draw_text(self._x0, 63 + self._y0, "Distance (km)", display.FONT_FIXED, display.LABEL)
+            screen.fill_rectangle(0, 91, 127, 9, display.BACKGROUND)
+            screen.draw_text(self._x0, 91 + self._y0, "Total Distance (km)", display.FONT_FIXED, display.LABEL)
+
+        if self._speed != self._speedometer.speed_x100 or needs_full_redraw:
+            self._speed = self._speedometer.speed_x100
+            self._trace.mark(latency.SCREEN)
+            screen.fill_rectangle(0, 9, 127, 25, display.BACKGROUND)
+            length = display.format_number(self._text, self._speed)
+            screen.draw_text(self._x0, 9 + self._y0, self._text, display.FONT_UNISPACE, display.VALUE, length=length)
+            # the driver writes synchronously, the speed is on the panel now
+            self._trace.mark(latency.FLUSH)
+
+        if self._top_speed != self._speedometer.top_speed_x100 or needs_full_redraw:
+            self._top_speed = self._speedometer.top_speed_x100
+            screen.fill_rectangle(0, 54, 127, 9, display.BACKGROUND)
+            length = display.format_number(self._text, self._top_speed)
+            screen.draw_text(self._x0, 54 + self._y0, self._text, display.FONT_FIXED, display.VALUE, length=length)
+
+        if self._trip != self._speedometer.trip_x100 or needs_full_redraw:
+            self._trip = self._speedometer.trip_x100
+            screen.fill_rectangle(0, 72, 127, 9, display.BACKGROUND)
+            length = display.format_number(self._text, self._trip)
+            screen.draw_text(self._x0, 72 + self._y0, self._text, display.FONT_FIXED, display.VALUE, length=length)
+
+        if self._distance != self._speedometer.distance_x100 or needs_full_redraw:
+            self._distance = self._speedometer.distance_x100
+            screen.fill_rectangle(0, 100, 127, 9, display.BACKGROUND)
+            length = display.format_number(self._text, self._distance)
+            screen.draw_text(self._x0, 100 + self._y0, self._text, display.FONT_FIXED, display.VALUE, length=length)
 
     def encoder_longpress(self):
         if self._reset_timer and self._reset_timer + self.RESET_TIMER > time.ticks_ms():
             print("SPEEDOMETER: reset trip triggered")
             self._speedometer.reset_trip()
-            self._speedometer.save()
+            self._speedometer.mark_dirty(flush=True)
         else:
             self._reset_timer = time.ticks_ms()
 
     def encoder_dblclick(self):
-        self._speedometer.save()
+        self._speedometer.mark_dirty(flush=True)
+
+class TripStatsScreen(display.DisplayScreen):
+    LABELS = ((0, "Avg Speed (km/h)"),
+              (27, "Moving Time"),
+              (54, "Max Accel (m/s2)"),
+              (81, "Speed p50/p95 (km/h)"))
+
+    def __init__(self, speedometer):
+        display.DisplayScreen.__init__(self)
+
+        self._stats = speedometer.stats
+        self._samples = None
+        self._max_acceleration = None
+
+    def update(self, screen, needs_full_redraw=False):
+        if needs_full_redraw:
+            for y, label in self.LABELS:
+                screen.fill_rectangle(0, y, 127, 9, display.BACKGROUND)
+                screen.draw_text(self._x0, y + self._y0, label, display.FONT_FIXED, display.LABEL)
+
+        stats = self._stats
+        if stats.samples == self._samples and stats.max_acceleration == self._max_acceleration and not needs_full_redraw:
+            return
+        self._samples = stats.samples
+        self._max_acceleration = stats.max_acceleration
+
+        moving_time = int(stats.moving_time)
+        values = ("{:.2f} +/- {:.2f}".format(stats.mean, stats.stddev),
+                  "{:d}:{:02d}:{:02d}".format(moving_time // 3600, moving_time // 60 % 60, moving_time % 60),
+                  "{:.2f}".format(stats.max_acceleration),
+                  "{:.0f} / {:.0f}".format(stats.percentile(50), stats.percentile(95)))
+        for (y, _), value in zip(self.LABELS, values):
+            screen.fill_rectangle(0, y + 9, 127, 9, display.BACKGROUND)
+            screen.draw_text(self._x0, y + 9 + self._y0, value, display.FONT_FIXED, display.VALUE)
+
+class LatencyScreen(display.DisplayScreen):
+    LABELS = ((0, "Reed > speed (ms)", latency.SPEED),
+              (27, "Reed > screen (ms)", latency.SCREEN),
+              (54, "Reed > pixels (ms)", latency.FLUSH))
+
+    def __init__(self):
+        display.DisplayScreen.__init__(self)
+
+        self._trace = latency.get_trace()
+        self._count = None
+
+    def update(self, screen, needs_full_redraw=False):
+        if needs_full_redraw:
+            for y, label, _ in self.LABELS:
+                screen.fill_rectangle(0, y, 127, 9, display.BACKGROUND)
+                screen.draw_text(self._x0, y + self._y0, label, display.FONT_FIXED, display.LABEL)
+            screen.fill_rectangle(0, 81, 127, 9, display.BACKGROUND)
+            screen.draw_text(self._x0, 81 + self._y0, "Abandoned", display.FONT_FIXED, display.LABEL)
+
+        count = self._trace.histograms[latency.FLUSH].count
+        if count == self._count and not needs_full_redraw:
+            return
+        self._count = count
+
+        for y, _, stage in self.LABELS:
+            _, _, avg, p95, maximum = self._trace.stats(stage)
+            screen.fill_rectangle(0, y + 9, 127, 9, display.BACKGROUND)
+            screen.draw_text(self._x0, y + 9 + self._y0,
+                             "{} / {} / {}".format(avg // 1000, p95 // 1000, maximum // 1000),
+                             display.FONT_FIXED, display.VALUE)
+        screen.fill_rectangle(0, 90, 127, 9, display.BACKGROUND)
+        screen.draw_text(self._x0, 90 + self._y0, "{}".format(self._trace.abandoned), display.FONT_FIXED, display.VALUE)
+
+    def encoder_longpress(self):
+        print("LATENCY: reset")
+        self._trace.dump()
+        self._trace.reset()
+        self._count = None
+
+class HeapScreen(display.DisplayScreen):
+    def __init__(self, collector):
+        display.DisplayScreen.__init__(self)
+
+        self._monitor = memstat.get_monitor()
+        self._collector = collector
+        self._largest_free = 0
+        self._probe = True
+
+    def update(self, screen, needs_full_redraw=False):
+        if needs_full_redraw:
+            screen.fill_rectangle(0, 0, 127, 9, display.BACKGROUND)
+            screen.draw_text(self._x0, 0 + self._y0, "Free/min/block (kB)", display.FONT_FIXED, display.LABEL)
+            screen.fill_rectangle(0, 27, 127, 9, display.BACKGROUND)
+            screen.draw_text(self._x0, 27 + self._y0, "Bytes/slice  avg  max", display.FONT_FIXED, display.LABEL)
+            self._probe = True
+
+        monitor = self._monitor
+        if self._probe:
+            # collects, only when asked for
+            self._probe = False
+            self._largest_free = monitor.largest_free()
+
+        screen.fill_rectangle(0, 9, 127, 9, display.BACKGROUND)
+        screen.draw_text(self._x0, 9 + self._y0,
+                         "{} / {} / {}".format(gc.mem_free() // 1024, monitor.min_free // 1024, self._largest_free // 1024),
+                         display.FONT_FIXED, display.VALUE)
+
+        collections = 0
+        y = 36
+        for name, slices, allocated, largest, gcs in monitor.stats():
+            collections += gcs
+            screen.fill_rectangle(0, y, 127, 9, display.BACKGROUND)
+            screen.draw_text(self._x0, y + self._y0,
+                             "{:<11}{:>5}{:>5}".format(name, allocated // slices if slices else 0, largest),
+                             display.FONT_FIXED, display.VALUE)
+            y += 9
+        # idle collections land between slices
+        collections -= monitor.collections[memstat.LOOP]
+        screen.fill_rectangle(0, y + 9, 127, 9, display.BACKGROUND)
+        screen.draw_text(self._x0, y + 9 + self._y0, "GC idle/task {}/{}".format(self._collector.collections, collections),
+                         display.FONT_FIXED, display.VALUE)
+
+    def encoder_click(self):
+        # find the largest free block again
+        self._probe = True
+
+    def encoder_longpress(self):
+        print("HEAP: reset")
+        self._monitor.dump()
+        self._collector.dump()
+        self._monitor.reset()
 
 class LightShowScreen(display.DisplayScreen):
     def __init__(self, light_show):
@@ -121,16 +304,14 @@ class LightShowScreen(display.DisplayScreen):
         self._dirty = False
 
     def update(self, screen, needs_full_redraw=False):
-        from ssd1351 import color565
-
         if needs_full_redraw:
-            screen.fill_rectangle(0, 0, 127, 9, color565(0, 0, 0))
-            screen.draw_text(0, 0, "Light Effect", display.FONT_FIXED, color565(255, 255, 255))
+            screen.fill_rectangle(0, 0, 127, 9, display.BACKGROUND)
+            screen.draw_text(0, 0, "Light Effect", display.FONT_FIXED, display.LABEL)
 
         if self._dirty or needs_full_redraw:
             self._dirty = False
-            screen.fill_rectangle(0, 9, 127, 9, color565(0, 0, 0))
-            screen.draw_text(self._x0, 9 + self._y0, self.light_show.effect, display.FONT_FIXED, color565(0, 255, 0))
+            screen.fill_rectangle(0, 9, 127, 9, display.BACKGROUND)
+            screen.draw_text(self._x0, 9 + self._y0, self.light_show.effect, display.FONT_FIXED, display.VALUE)
 
     def encoder_click(self):
         index = self._effect_order.index(self.light_show.effect)
@@ -141,28 +322,122 @@ class LightShowScreen(display.DisplayScreen):
         self._dirty = True
 
 
+class Boot(object):
+    # Brings the scooter up in stages, so that the logo shows right after
+    # power on: SPI and the logo first, the LED task next and everything
+    # else from a task once the loop runs, yielding to the LEDs in between.
+    # Logs when each phase is done in ms since reset, "logo" is the time to
+    # first pixel, and the free heap to compare builds with.
+    def __init__(self):
+        self.phases = []
+        self._last = 0
+
+        self.speedometer = None
+        self.ride_logger = None
+
+    def phase(self, name):
+        now = time.ticks_ms()
+        self.phases.append((name, now))
+        print("BOOT: {} at {}ms (+{}ms), {} bytes free".format(
+            name, now, time.ticks_diff(now, self._last), gc.mem_free()))
+        self._last = now
+
+    async def run(self, oled, store, light_show, collector):
+        display.load_fonts()
+        self.phase("fonts")
+        await asyncio.sleep_ms(0)
+
+        # speedometer, loads the persisted trip and totals
+        import pulselog
+        import ridelog
+        import speedometer
+        self.ride_logger = pulselog.PulseLogger()
+        ride_index = ridelog.RideIndex(persistence=store)
+        sm = speedometer.Speedometer(persistence=store, logger=self.ride_logger, ride_index=ride_index)
+        self.speedometer = sm
+        self.phase("speedometer")
+        await asyncio.sleep_ms(0)
+
+        speedometer_screen = SpeedometerScreen(sm)
+        trip_stats_screen = TripStatsScreen(sm)
+
+        # redraw speed screens as soon as new values are in
+        bus = events.get_event_bus()
+        bus.sub(speedometer.TOPIC, speedometer_screen.redraw)
+        bus.sub(speedometer.TOPIC, trip_stats_screen.redraw)
+
+        screens = [LogoScreen(light_show),
+                   speedometer_screen,
+                   trip_stats_screen,
+                   LightShowScreen(light_show)]
+
+        if DIAGNOSTICS:
+            # avg / p95 / max, long press dumps to the REPL and resets
+            latency_screen = LatencyScreen()
+            bus.sub(speedometer.TOPIC, latency_screen.redraw)
+            screens.append(latency_screen)
+
+            # allocations per subsystem, click finds the largest free block,
+            # long press dumps to the REPL and resets
+            heap_screen = HeapScreen(collector)
+            bus.sub(speedometer.TOPIC, heap_screen.redraw)
+            screens.append(heap_screen)
+
+        # display unit, takes over the display showing the logo
+        display.ScooterDisplay(screens, oled)
+        self.phase("screens")
+
+        # what's left for the ride, compare builds by this
+        gc.collect()
+        print("BOOT: done, {} bytes free after a collection".format(gc.mem_free()))
+
+
 def main():
-    # light show
-    light_show = lights.LightShow()
-    light_show_screen = LightShowScreen(light_show)
+    boot = Boot()
+    boot.phase("imports")
 
-    # speedometer
-    sm = speedometer.Speedometer()
-    speedometer_screen = SpeedometerScreen(sm)
+    # size the loop before anything creates tasks on it
+    loop = asyncio.get_event_loop(RUNQ_LEN, WAITQ_LEN)
+    # and to collect in the gaps between LED frames and redraws
+    collector = IdleCollector(collect_after=GC_COLLECT_AFTER, threshold=GC_THRESHOLD).install(loop)
 
-    # logo screen
-    logo_screen = LogoScreen(light_show)
+    # the logo before anything else
+    oled = display.open_display()
+    draw_logo(oled)
+    boot.phase("logo")
 
-    # display unit
-    display_unit = display.ScooterDisplay([logo_screen,
-                                           speedometer_screen,
-                                           light_show_screen])
+    # deferred flash writes
+    store = persistence.Persistence()
+
+    # light show
+    import lights
+    light_show = lights.LightShow(persistence=store)
+    boot.phase("lights")
+
+    # the rest once the loop runs
+    loop.create_task(boot.run(oled, store, light_show, collector))
+
+    if PROFILE_TASKS:
+        from uasyncio.profiler import TaskProfiler
+        loop.create_task(dump_profile(loop, TaskProfiler().install(loop), collector))
+    if DIAGNOSTICS:
+        memstat.get_monitor().install(loop)
+    if DIAGNOSTICS or WDT_TIMEOUT:
+        # timing every slice costs, only when asked for
+        LoopWatchdog(budget_ms=SLICE_BUDGET if DIAGNOSTICS else 0,
+                     wdt_timeout_ms=WDT_TIMEOUT).install(loop)
 
-    loop = asyncio.get_event_loop()
     try:
         loop.run_forever()
     except KeyboardInterrupt:
         print("Interrupted")
+    finally:
+        loop.dump_queues()
+        if boot.speedometer is not None:
+            boot.speedometer.end_ride()
+        store.shutdown()
+        if boot.ride_logger is not None:
+            boot.ride_logger.shutdown()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,131 @@
+import gc
+
+from uasyncio import core
+
+# subsystems allocations are attributed to. Task slices of untagged tasks
+# count as OTHER, LOOP is everything in between slices: the scheduler, IRQ
+# callbacks run through micropython.schedule and other loop monitors.
+LIGHTS = 0
+DISPLAY = 1
+SPEEDOMETER = 2
+INPUT = 3
+EVENTS = 4
+OTHER = 5
+LOOP = 6
+SUBSYSTEMS = ("LightShow", "Display", "Speedometer", "Input", "Events", "Other", "Loop")
+
+class HeapMonitor(object):
+    # EventLoop.monitor that reads gc.mem_alloc() around every task slice
+    # and books the difference on the subsystem the task was tagged with.
+    # An effect frame is a LightShow slice and a screen update a Display
+    # slice, so that covers them. A slice after which less is allocated
+    # than before had a collection run in it, those are counted instead.
+    #
+    # gc.mem_alloc() walks the heap's allocation table, only install this
+    # while looking for allocations. Chains to an already installed monitor.
+    #
+    # Usage:
+    #   memstat.tag(coro, memstat.LIGHTS)
+    #   monitor = memstat.get_monitor().install()
+    #   ...
+    #   monitor.dump()
+
+    def __init__(self):
+        self._tags = dict()
+        self._next = None
+        self._before = 0
+        self._after = None
+        self.reset()
+
+    def reset(self):
+        count = len(SUBSYSTEMS)
+        self.slices = [0] * count
+        self.allocated = [0] * count
+        self.largest = [0] * count
+        self.collections = [0] * count
+        self.min_free = gc.mem_free()
+        self._after = None
+
+    def tag(self, coro, subsystem):
+        self._tags[coro] = subsystem
+
+    def install(self, loop=None):
+        loop = loop or core.get_event_loop()
+        self._next = loop.monitor
+        loop.monitor = self
+        return self
+
+    def _book(self, subsystem, before, after):
+        self.slices[subsystem] += 1
+        if after < before:
+            self.collections[subsystem] += 1
+            return
+        delta = after - before
+        self.allocated[subsystem] += delta
+        if delta > self.largest[subsystem]:
+            self.largest[subsystem] = delta
+
+    def wake(self, task, t):
+        if self._next is not None:
+            self._next.wake(task, t)
+
+    def start(self, task):
+        if self._next is not None:
+            self._next.start(task)
+        self._before = gc.mem_alloc()
+        if self._after is not None:
+            self._book(LOOP, self._after, self._before)
+
+    def stop(self, task):
+        self._after = gc.mem_alloc()
+        self._book(self._tags.get(task, OTHER), self._before, self._after)
+        free = gc.mem_free()
+        if free < self.min_free:
+            self.min_free = free
+        if self._next is not None:
+            self._next.stop(task)
+
+    def done(self, task):
+        self._tags.pop(task, None)
+        if self._next is not None:
+            self._next.done(task)
+
+    def largest_free(self):
+        # Largest block that can be allocated after a collection, found by
+        # allocating. Collects a couple of times, not for the hot path.
+        gc.collect()
+        low = 0
+        high = gc.mem_free()
+        while high - low > 64:
+            size = (low + high) // 2
+            try:
+                block = bytearray(size)
+                block = None
+                low = size
+            except MemoryError:
+                high = size
+        gc.collect()
+        return low
+
+    def stats(self):
+        # [(name, slices, allocated bytes, largest slice bytes, collections)]
+        return [(SUBSYSTEMS[i], self.slices[i], self.allocated[i], self.largest[i], self.collections[i])
+                for i in range(len(SUBSYSTEMS))]
+
+    def dump(self, largest_free=True):
+        print("HEAP: free={} alloc={} min free={}".format(gc.mem_free(), gc.mem_alloc(), self.min_free))
+        if largest_free:
+            print("HEAP: largest free block={}".format(self.largest_free()))
+        for name, slices, allocated, largest, collections in self.stats():
+            print("HEAP: {} slices={} alloc={} avg={} max={} gc={}".format(
+                name, slices, allocated, allocated // slices if slices else 0, largest, collections))
+
+_monitor = None
+def get_monitor():
+    global _monitor
+    if _monitor is None:
+        _monitor = HeapMonitor()
+    return _monitor
+
+def tag(coro, subsystem):
+    get_monitor().tag(coro, subsystem)
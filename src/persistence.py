@@ -0,0 +1,74 @@
+import uasyncio as asyncio
+import time
+
+class Persistence(object):
+    # quiet period after the last change before writing
+    DEBOUNCE = 5 * 1000     # 5s
+    # upper bound for how long a change may stay unwritten
+    MAX_DELAY = 60 * 1000   # 1min
+    # how often the flush task checks for due writes
+    INTERVAL = 250
+
+    def __init__(self, debounce=DEBOUNCE, max_delay=MAX_DELAY, interval=INTERVAL):
+        self._debounce = debounce
+        self._max_delay = max_delay
+        self._interval = interval
+
+        self._dirty = dict()
+        self._first_dirty = None
+        self._last_dirty = None
+        self._flush_requested = False
+
+        loop = asyncio.get_event_loop()
+        loop.create_task(self.run())
+
+    def mark_dirty(self, key, saver):
+        now = time.ticks_ms()
+        self._dirty[key] = saver
+        if self._first_dirty is None:
+            self._first_dirty = now
+        self._last_dirty = now
+
+    def request_flush(self):
+        # write on the next pass of the flush task, without blocking the caller
+        self._flush_requested = True
+
+    def is_dirty(self):
+        return bool(self._dirty)
+
+    def _due(self, now):
+        if not self._dirty:
+            return False
+        if self._flush_requested:
+            return True
+        return time.ticks_diff(now, self._last_dirty) >= self._debounce \
+            or time.ticks_diff(now, self._first_dirty) >= self._max_delay
+
+    def flush(self):
+        self._flush_requested = False
+        if not self._dirty:
+            return
+
+        savers = self._dirty
+        self._dirty = dict()
+        self._first_dirty = None
+        self._last_dirty = None
+
+        start = time.ticks_ms()
+        for key, saver in savers.items():
+            try:
+                saver()
+            except Exception as exc:
+                print("PERSISTENCE: ERROR - could not save {}: {!r}".format(key, exc))
+        print("PERSISTENCE: Flushed {} in {}ms".format(", ".join(savers.keys()),
+                                                        time.ticks_diff(time.ticks_ms(), start)))
+
+    def shutdown(self):
+        print("PERSISTENCE: Shutdown, flushing pending writes")
+        self.flush()
+
+    async def run(self):
+        while True:
+            if self._due(time.ticks_ms()):
+                self.flush()
+            await asyncio.sleep_ms(self._interval)
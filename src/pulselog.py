@@ -0,0 +1,121 @@
+import struct
+import time
+
+from ridelog import DIRECTORY, RotatingLog
+
+# Pulse timestamps are stored in fixed size blocks:
+#
+#   header: pulse count (u16), first timestamp (u32), delta to the pulse
+#           before it (i32, 0 if unknown)
+#   body:   one zigzag varint per further pulse holding the delta-of-delta,
+#           zero padded up to BLOCK_SIZE
+#
+# Periods of consecutive revolutions hardly change while riding, so most
+# pulses end up as a single byte instead of a 4 byte timestamp.
+BLOCK_SIZE = 128
+HEADER = "<HIi"
+HEADER_SIZE = struct.calcsize(HEADER)
+
+_EMPTY_BLOCK = bytes(BLOCK_SIZE)
+
+def zigzag(value):
+    if value >= 0:
+        return value << 1
+    return ((-value) << 1) - 1
+
+def varint_length(value):
+    length = 1
+    while value > 0x7f:
+        value >>= 7
+        length += 1
+    return length
+
+class PulseEncoder(object):
+    def __init__(self, log):
+        self._log = log
+
+        self._buf = None
+        self._block = 0
+        self._pos = 0
+        self._count = 0
+
+        self._last = None
+        self._delta = 0
+
+        self.pulses = 0
+        self.blocks = 0
+
+    def sync(self):
+        # start a new, self contained block with the next pulse
+        self._buf = None
+        self._last = None
+        self._delta = 0
+
+    def _start_block(self, timestamp, delta):
+        offset = self._log.reserve(BLOCK_SIZE)
+        if offset < 0:
+            self._buf = None
+            return
+
+        buf = self._log.page
+        buf[offset:offset + BLOCK_SIZE] = _EMPTY_BLOCK
+        struct.pack_into(HEADER, buf, offset, 1, timestamp & 0xffffffff, delta)
+
+        self._buf = buf
+        self._block = offset
+        self._pos = offset + HEADER_SIZE
+        self._count = 1
+        self.blocks += 1
+
+    def add(self, timestamp):
+        delta = 0
+        if self._last is not None:
+            delta = time.ticks_diff(timestamp, self._last)
+        self.pulses += 1
+
+        if self._buf is None:
+            self._start_block(timestamp, delta)
+        else:
+            value = zigzag(delta - self._delta)
+            if self._pos + varint_length(value) > self._block + BLOCK_SIZE:
+                self._start_block(timestamp, delta)
+            else:
+                buf = self._buf
+                pos = self._pos
+                while value > 0x7f:
+                    buf[pos] = (value & 0x7f) | 0x80
+                    value >>= 7
+                    pos += 1
+                buf[pos] = value
+                self._pos = pos + 1
+                self._count += 1
+                struct.pack_into("<H", buf, self._block, self._count)
+
+        self._last = timestamp
+        self._delta = delta
+
+class PulseLogger(object):
+    def __init__(self, directory=DIRECTORY, **kwargs):
+        self._log = RotatingLog("pulse", directory=directory, **kwargs)
+        self._encoder = PulseEncoder(self._log)
+
+    @property
+    def dropped(self):
+        return self._log.dropped
+
+    def tell(self):
+        return self._log.tell()
+
+    def start_ride(self):
+        # rides start on a block boundary so they can be decoded on their own
+        self._encoder.sync()
+        return self._log.tell(BLOCK_SIZE)
+
+    def log(self, timestamp, revolutions, period, speed):
+        # Speedometer's logger interface, everything but the timestamp can
+        # be derived again when decoding
+        self._encoder.add(timestamp)
+
+    def shutdown(self):
+        print("PULSELOG: Shutdown, flushing pulse log")
+        self._log.flush()
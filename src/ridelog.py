@@ -0,0 +1,263 @@
+import os
+import struct
+
+import uasyncio as asyncio
+
+DIRECTORY = "/data/rides"
+
+PAGE_SIZE = 4096            # one flash sector
+FILE_SIZE = 32 * PAGE_SIZE  # 128KB per file
+FILE_COUNT = 6              # oldest file gets deleted on rotation
+FLUSH_INTERVAL = 500
+
+# timestamp (ticks_ms), total revolutions, period (ms), speed (km/h * 100)
+SAMPLE = "<IIHH"
+SAMPLE_SIZE = struct.calcsize(SAMPLE)
+
+INDEX_PATH = DIRECTORY + "/index.bin"
+INDEX_PENDING = 4
+
+# start (time.time()), duration (s), distance (m), top speed (km/h * 100),
+# average speed (km/h * 100), log file index, padding, offset in log file
+INDEX_ENTRY = "<IIIHHHHI"
+INDEX_ENTRY_SIZE = struct.calcsize(INDEX_ENTRY)
+
+def log_path(directory, prefix, index):
+    return "{}/{}{:04d}.bin".format(directory, prefix, index)
+
+def makedirs(path):
+    current = ""
+    for part in path.split("/"):
+        if not part:
+            continue
+        current += "/" + part
+        try:
+            os.mkdir(current)
+        except OSError:
+            pass
+
+class RotatingLog(object):
+    def __init__(self, prefix, directory=DIRECTORY, page_size=PAGE_SIZE,
+                 file_size=FILE_SIZE, file_count=FILE_COUNT, interval=FLUSH_INTERVAL):
+        self._prefix = prefix
+        self._directory = directory
+        self._page_size = page_size
+        self._file_size = file_size
+        self._file_count = file_count
+        self._interval = interval
+
+        # double buffered: records go into the active page while the other
+        # one waits for the flush task
+        self._pages = (bytearray(page_size), bytearray(page_size))
+        self._views = (memoryview(self._pages[0]), memoryview(self._pages[1]))
+        self._active = 0
+        self._fill = 0
+        self._pending = -1
+        self._pending_fill = 0
+
+        self.dropped = 0
+        self.written = 0
+
+        makedirs(directory)
+        self._file_index, self._file_offset = self._find_current()
+
+        # The flush task runs at normal priority, the lowest the loop has.
+        # It already yields to the high priority input and LED tasks, and
+        # a page write is a single call either way.
+        loop = asyncio.get_event_loop()
+        loop.create_task(self.run())
+
+    def _find_current(self):
+        index = -1
+        for name in os.listdir(self._directory):
+            if not name.startswith(self._prefix) or not name.endswith(".bin"):
+                continue
+            try:
+                index = max(index, int(name[len(self._prefix):-4]))
+            except ValueError:
+                pass
+        if index < 0:
+            return 0, 0
+
+        try:
+            size = os.stat(log_path(self._directory, self._prefix, index))[6]
+        except OSError:
+            size = 0
+        return index, size
+
+    @property
+    def page(self):
+        return self._pages[self._active]
+
+    def tell(self, size=1):
+        # (file index, offset) a record of size bytes reserved next will end
+        # up at, mirrors the page switch in reserve() and the rotation done
+        # in _write before every page
+        index = self._file_index
+        offset = self._file_offset
+        fill = self._fill
+        if self._pending >= 0 and self._pending_fill:
+            if offset >= self._file_size:
+                index += 1
+                offset = 0
+            offset += self._pending_fill
+        if fill + size > self._page_size:
+            # the record starts a new page, the active one gets written
+            # before it
+            if fill:
+                if offset >= self._file_size:
+                    index += 1
+                    offset = 0
+                offset += fill
+            fill = 0
+        if offset >= self._file_size:
+            index += 1
+            offset = 0
+        return index, offset + fill
+
+    def reserve(self, size):
+        # returns the offset into self.page to pack a record of size bytes
+        # into, or -1 if both pages are full and the record has to be dropped
+        if self._fill + size > self._page_size:
+            if self._pending >= 0:
+                self.dropped += 1
+                return -1
+            self._pending = self._active
+            self._pending_fill = self._fill
+            self._active ^= 1
+            self._fill = 0
+
+        offset = self._fill
+        self._fill += size
+        return offset
+
+    def _write(self, page, length):
+        if not length:
+            return
+
+        if self._file_offset >= self._file_size:
+            self._file_index += 1
+            self._file_offset = 0
+            try:
+                os.remove(log_path(self._directory, self._prefix, self._file_index - self._file_count))
+            except OSError:
+                pass
+
+        try:
+            with open(log_path(self._directory, self._prefix, self._file_index), "ab") as f:
+                f.write(self._views[page][:length])
+            self._file_offset += length
+            self.written += length
+        except OSError as exc:
+            print("RIDELOG: ERROR - could not write {} log: {!r}".format(self._prefix, exc))
+
+    def flush(self):
+        if self._pending >= 0:
+            self._write(self._pending, self._pending_fill)
+            self._pending = -1
+        self._write(self._active, self._fill)
+        self._fill = 0
+
+    async def run(self):
+        while True:
+            if self._pending >= 0:
+                self._write(self._pending, self._pending_fill)
+                self._pending = -1
+            await asyncio.sleep_ms(self._interval)
+
+class RideLogger(object):
+    # Fixed size samples, the format before PulseLogger. Still readable
+    # with tools/ridelog2csv.py, main doesn't use it anymore.
+    def __init__(self, directory=DIRECTORY, **kwargs):
+        self._log = RotatingLog("ride", directory=directory, **kwargs)
+
+    @property
+    def dropped(self):
+        return self._log.dropped
+
+    def tell(self):
+        return self._log.tell()
+
+    def start_ride(self):
+        return self._log.tell(SAMPLE_SIZE)
+
+    def log(self, timestamp, revolutions, period, speed):
+        offset = self._log.reserve(SAMPLE_SIZE)
+        if offset < 0:
+            return
+        struct.pack_into(SAMPLE, self._log.page, offset,
+                         timestamp, revolutions, min(period, 0xffff), min(speed, 0xffff))
+
+    def shutdown(self):
+        print("RIDELOG: Shutdown, flushing ride log")
+        self._log.flush()
+
+class RideIndex(object):
+    # One fixed size entry per finished ride, so looking up a ride or its
+    # summary is a single seek and read no matter how many rides there are.
+    def __init__(self, path=INDEX_PATH, persistence=None):
+        self._path = path
+        self._persistence = persistence
+
+        # entries not yet written to flash
+        self._pending = bytearray(INDEX_ENTRY_SIZE * INDEX_PENDING)
+        self._pending_count = 0
+
+        makedirs(path[:path.rfind("/")])
+        try:
+            self._stored = os.stat(path)[6] // INDEX_ENTRY_SIZE
+        except OSError:
+            self._stored = 0
+
+    def __len__(self):
+        return self._stored + self._pending_count
+
+    def append(self, start, duration, distance, top_speed, avg_speed, file_index, offset):
+        if self._pending_count >= INDEX_PENDING:
+            self.save()
+        if self._pending_count >= INDEX_PENDING:
+            # still can't write, make room rather than overrun _pending
+            print("RIDEINDEX: ERROR - pending entries full, dropping the oldest")
+            self._pending[:-INDEX_ENTRY_SIZE] = self._pending[INDEX_ENTRY_SIZE:]
+            self._pending_count -= 1
+
+        struct.pack_into(INDEX_ENTRY, self._pending, self._pending_count * INDEX_ENTRY_SIZE,
+                         start, duration, distance, min(top_speed, 0xffff), min(avg_speed, 0xffff),
+                         file_index, 0, offset)
+        self._pending_count += 1
+        print("RIDEINDEX: Ride #{} added, {}s, {}m".format(len(self) - 1, duration, distance))
+
+        if self._persistence:
+            self._persistence.mark_dirty("ride_index", self.save)
+        else:
+            self.save()
+
+    def get(self, ride):
+        # returns (start, duration, distance, top speed, average speed,
+        # file index, offset), speeds in km/h * 100
+        if ride < 0:
+            ride += len(self)
+        if ride < 0 or ride >= len(self):
+            raise IndexError()
+
+        if ride >= self._stored:
+            entry = struct.unpack_from(INDEX_ENTRY, self._pending, (ride - self._stored) * INDEX_ENTRY_SIZE)
+        else:
+            with open(self._path, "rb") as f:
+                f.seek(ride * INDEX_ENTRY_SIZE)
+                entry = struct.unpack(INDEX_ENTRY, f.read(INDEX_ENTRY_SIZE))
+        return entry[:6] + entry[7:]
+
+    def last(self, count):
+        return [self.get(ride) for ride in range(max(0, len(self) - count), len(self))]
+
+    def save(self):
+        if not self._pending_count:
+            return
+        try:
+            with open(self._path, "ab") as f:
+                f.write(memoryview(self._pending)[:self._pending_count * INDEX_ENTRY_SIZE])
+            self._stored += self._pending_count
+            self._pending_count = 0
+        except OSError as exc:
+            print("RIDEINDEX: ERROR - could not write {}: {!r}".format(self._path, exc))
@@ -1,7 +1,13 @@
+import array
 import machine
 import uasyncio as asyncio
 import time
 
+import events
+import latency
+import memstat
+import tripstats
+
 REED_PIN = machine.Pin(16, machine.Pin.IN, machine.Pin.PULL_UP)
 RADIUS = 100.0
 
@@ -9,9 +15,26 @@ DISTANCE_PER_ROTATION = 2 * 3.14159 * RADIUS
 DELAY = 1.0
 HOUR_FRACTION = 3600.0 / DELAY
 
+# km/h * 100 = SPEED_FACTOR // period in ms
+SPEED_FACTOR = int(DISTANCE_PER_ROTATION * 360)
+
+TOPIC = "speedometer"
+
+# a ride ends after this long without a wheel revolution
+RIDE_TIMEOUT = 2 * 60 * 1000 # 2min
+
 class SwitchCounter(object):
+    PULSE_BUFFER = 32 # must be a power of two
+
     def __init__(self, pin, trigger=machine.Pin.IRQ_FALLING, debounce=300):
         self._counter = 0
+
+        # ring of pulse timestamps, written from the interrupt handler
+        self._pulses = array.array("I", [0] * self.PULSE_BUFFER)
+        self._pulse_head = 0
+        self._pulse_tail = 0
+
+        self._trace = latency.get_trace()
         pin.irq(trigger=trigger, handler=self.handle_interrupt)
 
         # debounce
@@ -23,33 +46,121 @@ class SwitchCounter(object):
         self._counter = 0
         return counter
 
+    def has_pulses(self):
+        return self._pulse_tail != self._pulse_head
+
+    def pop_pulse(self):
+        if self._pulse_head - self._pulse_tail > self.PULSE_BUFFER:
+            # overrun, skip what got overwritten
+            self._pulse_tail = self._pulse_head - self.PULSE_BUFFER
+        pulse = self._pulses[self._pulse_tail & (self.PULSE_BUFFER - 1)]
+        self._pulse_tail += 1
+        return pulse
+
     def handle_interrupt(self, pin):
-        if time.ticks_ms() > self._debounced_until:
+        now = time.ticks_ms()
+        if now > self._debounced_until:
             print("SPEEDOMETER: beep")
-            self._debounced_until = time.ticks_ms() + self._debounce
+            self._debounced_until = now + self._debounce
             self._counter += 1
+            self._pulses[self._pulse_head & (self.PULSE_BUFFER - 1)] = now
+            self._pulse_head += 1
+            self._trace.start()
 
 class Speedometer(object):
-    def __init__(self, callback=None):
+    def __init__(self, callback=None, persistence=None, logger=None, ride_index=None):
+        self._persistence = persistence
+        self._logger = logger
+        self._ride_index = ride_index
         self.counter = SwitchCounter(REED_PIN, debounce=50)
 
+        self.revolutions = 0
+        self._last_pulse = None
+
+        # current ride
+        self._ride_start = None
+        self._ride_first_pulse = 0
+        self._ride_revolutions = 0
+        self._ride_top_speed = 0.0
+        self._ride_position = (0, 0)
+
         self.speed = 0.0
         self.distance = 0.0
         self.top_speed = 0.0
         self.trip = 0.0
+        # the above as scaled ints for the display, km/h * 100 and km * 100
+        self.speed_x100 = 0
+        self.distance_x100 = 0
+        self.top_speed_x100 = 0
+        self.trip_x100 = 0
+        self.stats = tripstats.TripStats()
+        self._trace = latency.get_trace()
+
+        self._bus = events.get_event_bus()
+        self._bus.topic(TOPIC, coalesce=True)
 
         self.load()
 
         loop = asyncio.get_event_loop()
-        loop.create_task(self.update())
-        loop.create_task(self.persist())
+        task = self.update()
+        memstat.tag(task, memstat.SPEEDOMETER)
+        loop.create_task(task, asyncio.PRIORITY_HIGH)
+        if self._persistence is None:
+            task = self.persist()
+            memstat.tag(task, memstat.SPEEDOMETER)
+            loop.create_task(task)
 
     def reset_trip(self):
         self.trip = 0.0
         self.top_speed = 0.0
+        self._scale()
+        self.stats.reset()
+        self._bus.pub(TOPIC, self)
+
+    def start_ride(self, pulse):
+        self._ride_start = time.time()
+        self._ride_first_pulse = pulse
+        self._ride_revolutions = 0
+        self._ride_top_speed = 0.0
+        if self._logger:
+            self._ride_position = self._logger.start_ride()
+        print("SPEEDOMETER: Ride started")
+
+    def end_ride(self):
+        if self._ride_start is None:
+            return
+
+        duration = time.ticks_diff(self._last_pulse, self._ride_first_pulse) // 1000
+        distance = int(self._ride_revolutions * DISTANCE_PER_ROTATION / 1000.0)
+        avg_speed = distance * 360 // duration if duration > 0 else 0
+        if self._ride_index is not None:
+            file_index, offset = self._ride_position
+            self._ride_index.append(self._ride_start, duration, distance,
+                                    int(self._ride_top_speed * 100), avg_speed,
+                                    file_index, offset)
+        self._ride_start = None
+        print("SPEEDOMETER: Ride ended")
+
+    def process_pulses(self):
+        while self.counter.has_pulses():
+            pulse = self.counter.pop_pulse()
+            if self._ride_start is None:
+                self.start_ride(pulse)
+            self.revolutions += 1
+            self._ride_revolutions += 1
+
+            period = 0
+            if self._last_pulse is not None:
+                period = time.ticks_diff(pulse, self._last_pulse)
+            self._last_pulse = pulse
+
+            if self._logger:
+                self._logger.log(pulse, self.revolutions, period,
+                                 SPEED_FACTOR // period if period > 0 else 0)
 
     async def update(self):
         while(True):
+            self.process_pulses()
             counter_value = self.counter.pop_counter()
             distance = counter_value * DISTANCE_PER_ROTATION / 1000.0 # in m
             speed = HOUR_FRACTION * distance / 1000.0                 # in km/h
@@ -62,9 +173,39 @@ class Speedometer(object):
             self.distance += distance
             self.trip += distance
             self.top_speed = max(self.top_speed, self.speed)
+            self.stats.update(self.speed, DELAY)
+            self._trace.mark(latency.SPEED)
+
+            if dirty:
+                self._scale()
+                self._bus.pub(TOPIC, self)
+
+            if distance > 0:
+                self.mark_dirty()
+
+            if self._ride_start is not None:
+                self._ride_top_speed = max(self._ride_top_speed, self.speed)
+                if time.ticks_diff(time.ticks_ms(), self._last_pulse) > RIDE_TIMEOUT:
+                    self.end_ride()
 
             await asyncio.sleep(DELAY)
 
+    def _scale(self):
+        self.speed_x100 = round(self.speed * 100)
+        self.distance_x100 = round(self.distance / 10)
+        self.top_speed_x100 = round(self.top_speed * 100)
+        self.trip_x100 = round(self.trip / 10)
+
+    def mark_dirty(self, flush=False):
+        if self._persistence is None:
+            if flush:
+                self.save()
+            return
+
+        self._persistence.mark_dirty("speedometer", self.save)
+        if flush:
+            self._persistence.request_flush()
+
     def load(self):
         try:
             with open("/data/total.txt", "rb") as f:
@@ -81,6 +222,9 @@ class Speedometer(object):
         except:
             print("SPEEDOMETER: ERROR - could not read trip and speed from /data/trip.txt, does it exist?")
 
+        self.stats.load()
+        self._scale()
+
     def save(self, trip=True, total=True):
         if total:
             try:
@@ -99,6 +243,8 @@ class Speedometer(object):
             except:
                 print("SPEEDOMETER: ERROR - could not save trip to /data/trip.txt")
 
+            self.stats.save()
+
     async def persist(self):
         distance = self.distance
         trip = self.trip
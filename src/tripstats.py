@@ -0,0 +1,93 @@
+import array
+import struct
+
+STATS_PATH = "/data/tripstats.bin"
+
+MOVING_SPEED = 1.0  # km/h, anything below counts as standing
+BUCKET_SIZE = 2     # km/h per histogram bucket
+BUCKETS = 25        # last bucket also takes everything faster
+
+# samples, mean, m2, moving time, max acceleration, histogram
+HEADER = "<Iffff"
+HEADER_SIZE = struct.calcsize(HEADER)
+
+class TripStats(object):
+    # Running aggregates over the trip, constant memory and constant time per
+    # sample: Welford mean/variance of the moving speed, moving time, maximum
+    # acceleration and a fixed bucket speed histogram for percentiles.
+    def __init__(self):
+        self._histogram = array.array("I", [0] * BUCKETS)
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.moving_time = 0.0
+        self.max_acceleration = 0.0
+        self._last_speed = 0.0
+        for i in range(BUCKETS):
+            self._histogram[i] = 0
+
+    def update(self, speed, dt):
+        # speed in km/h, dt in s
+        acceleration = (speed - self._last_speed) / 3.6 / dt
+        self._last_speed = speed
+        if acceleration > self.max_acceleration:
+            self.max_acceleration = acceleration
+
+        if speed < MOVING_SPEED:
+            return
+
+        self.moving_time += dt
+        self.samples += 1
+        delta = speed - self.mean
+        self.mean += delta / self.samples
+        self._m2 += delta * (speed - self.mean)
+
+        self._histogram[min(int(speed) // BUCKET_SIZE, BUCKETS - 1)] += 1
+
+    @property
+    def variance(self):
+        if self.samples < 2:
+            return 0.0
+        return self._m2 / (self.samples - 1)
+
+    @property
+    def stddev(self):
+        return self.variance ** 0.5
+
+    def percentile(self, p):
+        # upper bound of the bucket containing the p-th percentile, in km/h
+        if not self.samples:
+            return 0.0
+        rank = self.samples * p / 100.0
+        seen = 0
+        for i in range(BUCKETS):
+            seen += self._histogram[i]
+            if seen >= rank:
+                return float((i + 1) * BUCKET_SIZE)
+        return float(BUCKETS * BUCKET_SIZE)
+
+    def load(self, path=STATS_PATH):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            self.samples, self.mean, self._m2, self.moving_time, self.max_acceleration = \
+                struct.unpack_from(HEADER, data)
+            histogram = struct.unpack_from("<{}I".format(BUCKETS), data, HEADER_SIZE)
+            for i in range(BUCKETS):
+                self._histogram[i] = histogram[i]
+            print("TRIPSTATS: Loaded trip statistics from {}".format(path))
+        except:
+            print("TRIPSTATS: ERROR - could not read trip statistics from {}, does it exist?".format(path))
+
+    def save(self, path=STATS_PATH):
+        try:
+            with open(path, "wb") as f:
+                f.write(struct.pack(HEADER, self.samples, self.mean, self._m2,
+                                    self.moving_time, self.max_acceleration))
+                f.write(self._histogram)
+            print("TRIPSTATS: Persisted trip statistics to {}".format(path))
+        except:
+            print("TRIPSTATS: ERROR - could not save trip statistics to {}".format(path))
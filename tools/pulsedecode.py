@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Decode delta-of-delta encoded pulse logs pulled from the scooter.
+
+Writes CSV with one row per wheel revolution. Uses numpy to decode whole
+blocks at once if it is installed, and falls back to a plain Python decoder
+otherwise.
+"""
+
+import csv
+import struct
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Must match src/pulselog.py
+BLOCK_SIZE = 128
+HEADER = "<HIi"
+HEADER_SIZE = struct.calcsize(HEADER)
+
+# Must match utime.ticks_ms() on the ESP32, which wraps around at 2**30 ms
+TICKS_PERIOD = 1 << 30
+
+# Must match src/speedometer.py, km/h * 100 = SPEED_FACTOR // period in ms
+RADIUS = 100.0
+SPEED_FACTOR = int(2 * 3.14159 * RADIUS * 360)
+
+
+def error(msg):
+    """Display error and exit."""
+    print(msg)
+    sys.exit(-1)
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def decode_block_py(block):
+    """Return the list of pulse timestamps stored in one block."""
+    count, timestamp, delta = struct.unpack_from(HEADER, block)
+    if not count:
+        return []
+    timestamps = [timestamp]
+    pos = HEADER_SIZE
+    for _ in range(count - 1):
+        value = shift = 0
+        while True:
+            b = block[pos]
+            pos += 1
+            value |= (b & 0x7f) << shift
+            shift += 7
+            if not b & 0x80:
+                break
+        delta += unzigzag(value)
+        timestamp += delta
+        timestamps.append(timestamp)
+    return timestamps
+
+
+def decode_block_np(block):
+    """Vectorised version of decode_block_py."""
+    count, timestamp, delta = struct.unpack_from(HEADER, block)
+    if not count:
+        return np.zeros(0, dtype=np.int64)
+    if count == 1:
+        return np.array([timestamp], dtype=np.int64)
+
+    body = np.frombuffer(block, dtype=np.uint8, offset=HEADER_SIZE)
+    ends = np.flatnonzero((body & 0x80) == 0)[:count - 1]
+    body = body[:ends[-1] + 1]
+    starts = np.concatenate(([0], ends[:-1] + 1))
+
+    # position of every byte within its varint gives its shift
+    group = np.zeros(len(body), dtype=np.int64)
+    group[starts[1:]] = 1
+    group = np.cumsum(group)
+    shift = 7 * (np.arange(len(body)) - starts[group])
+
+    values = np.add.reduceat((body & 0x7f).astype(np.int64) << shift, starts)
+    dods = (values >> 1) ^ -(values & 1)
+    deltas = delta + np.cumsum(dods)
+    return np.concatenate(([timestamp], timestamp + np.cumsum(deltas)))
+
+
+def read_pulses(paths):
+    """Yield pulse timestamps (ms) from pulse logs, oldest first.
+
+    Block headers hold ticks_ms(), which wraps around every TICKS_PERIOD
+    (12.4 days of uptime). A running offset carried across blocks and files
+    keeps the timestamps monotonic, a block starting before the previous
+    one ended gets another period added.
+    """
+    decode = decode_block_np if np is not None else decode_block_py
+    wrap = 0
+    last = None
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        for offset in range(0, len(data) - BLOCK_SIZE + 1, BLOCK_SIZE):
+            block = data[offset:offset + BLOCK_SIZE]
+            count, first, _ = struct.unpack_from(HEADER, block)
+            if not count:
+                continue
+            if last is not None:
+                while first + wrap < last:
+                    wrap += TICKS_PERIOD
+            for timestamp in decode(block):
+                last = int(timestamp) + wrap
+                yield last
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    if len(args) < 2:
+        error("Please specify pulse logs: ./pulsedecode.py pulse0000.bin [...] > ride.csv")
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(("timestamp_ms", "revolutions", "period_ms", "speed_kmh"))
+    revolutions = 0
+    last = None
+    for timestamp in read_pulses(args[1:]):
+        revolutions += 1
+        period = timestamp - last if last is not None else 0
+        speed = SPEED_FACTOR // period if period > 0 else 0
+        writer.writerow((timestamp, revolutions, period, "{:.2f}".format(speed / 100.0)))
+        last = timestamp
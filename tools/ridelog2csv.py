@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""Convert binary ride logs pulled from the scooter to CSV."""
+
+import csv
+import struct
+import sys
+
+# Must match SAMPLE in src/ridelog.py:
+# timestamp (ticks_ms), total revolutions, period (ms), speed (km/h * 100)
+SAMPLE = "<IIHH"
+SAMPLE_SIZE = struct.calcsize(SAMPLE)
+
+
+def error(msg):
+    """Display error and exit."""
+    print(msg)
+    sys.exit(-1)
+
+
+def read_samples(path):
+    """Yield (timestamp, revolutions, period, speed in km/h) from a ride log."""
+    with open(path, "rb") as f:
+        data = f.read()
+    usable = len(data) - len(data) % SAMPLE_SIZE
+    for timestamp, revolutions, period, speed in struct.iter_unpack(SAMPLE, data[:usable]):
+        yield timestamp, revolutions, period, speed / 100.0
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    if len(args) < 2:
+        error("Please specify ride logs: ./ridelog2csv.py ride0000.bin [...] > ride.csv")
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(("timestamp_ms", "revolutions", "period_ms", "speed_kmh"))
+    for path in args[1:]:
+        for timestamp, revolutions, period, speed in read_samples(path):
+            writer.writerow((timestamp, revolutions, period, "{:.2f}".format(speed)))